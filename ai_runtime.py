@@ -0,0 +1,580 @@
+# ai_runtime.py
+"""
+Инфраструктура вокруг вызовов Gemini (без привязки к Telegram).
+
+ConcurrencyLimiter — ограничение числа одновременных запросов к модели.
+Запрос, который не дождался свободного слота за wait_timeout секунд,
+получает AiQueueTimeout, и бот отвечает запасным текстом вместо того,
+чтобы копить очередь.
+
+LatencyStats — задержки (например, время до первого токена при стриминге).
+EditThrottle — частота правок сообщения в одном чате при стриминге ответа.
+ResponseCache — LRU+TTL кэш ответов на частые короткие сообщения (cache_key()).
+CircuitBreaker, ResilientCaller — дедлайны, повторы с джиттером, хеджирование
+и автомат-выключатель, чтобы при сбоях Gemini не ждать каждый раз таймаут.
+ConversationMemory, HistoryStore — память разговора в режиме ИИ с бюджетом
+токенов на пользователя и общим потолком на все чаты.
+"""
+
+import asyncio
+import random
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from anonymize import anonymize_text
+
+try:
+    import httpx                    # транспорт google-genai
+except ImportError:                 # pragma: no cover
+    httpx = None
+
+
+class AiQueueTimeout(Exception):
+    """Не дождались свободного слота для запроса к модели."""
+
+
+class ConcurrencyLimiter:
+    """Семафор на запросы к модели + метрики очереди."""
+
+    def __init__(self, limit: int, wait_timeout: float):
+        self.limit = max(1, limit)
+        self.wait_timeout = wait_timeout
+        self._sem = asyncio.Semaphore(self.limit)
+
+        self.waiting = 0            # сейчас ждут слот (глубина очереди)
+        self.in_flight = 0          # сейчас выполняются
+        self.max_waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        t0 = time.monotonic()
+        self.waiting += 1
+        if self.waiting > self.max_waiting:
+            self.max_waiting = self.waiting
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.wait_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise AiQueueTimeout(f"нет свободного слота за {self.wait_timeout:.1f} с")
+        finally:
+            self.waiting -= 1
+            waited = time.monotonic() - t0
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+
+        self.acquired += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def try_acquire(self) -> bool:
+        """
+        Занять слот, только если он свободен прямо сейчас (без очереди).
+        True — слот занят, вернуть его release(). Так ResilientCaller берёт
+        слот под хедж: вторая попытка не должна превышать лимит.
+        """
+        if self._sem.locked():
+            return False
+        await self._sem.acquire()           # слот свободен — acquire() не уступает управление
+        self.acquired += 1
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._sem.release()
+
+    def metrics(self) -> dict:
+        attempts = self.acquired + self.timeouts
+        return {
+            "ai_limit": self.limit,
+            "ai_in_flight": self.in_flight,
+            "ai_queue_depth": self.waiting,
+            "ai_queue_depth_max": self.max_waiting,
+            "ai_queue_timeouts": self.timeouts,
+            "ai_queue_wait_avg_ms": (self.wait_total / attempts * 1000) if attempts else 0.0,
+            "ai_queue_wait_max_ms": self.wait_max * 1000,
+        }
+
+
+class LatencyStats:
+    """Счётчик задержек: количество, сумма, максимум и перцентили по последним замерам."""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self._recent.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self._recent:
+            return 0.0
+        data = sorted(self._recent)
+        return data[min(len(data) - 1, int(p / 100 * len(data)))]
+
+    def metrics(self, prefix: str) -> dict:
+        return {
+            f"{prefix}_count": self.count,
+            f"{prefix}_avg_ms": (self.total / self.count * 1000) if self.count else 0.0,
+            f"{prefix}_p50_ms": self.percentile(50) * 1000,
+            f"{prefix}_p95_ms": self.percentile(95) * 1000,
+            f"{prefix}_max_ms": self.max * 1000,
+        }
+
+
+class EditThrottle:
+    """
+    Ограничение частоты правок сообщений в одном чате.
+
+    Telegram плохо переносит частые edit_message_text в одном чате (ловим
+    RetryAfter), поэтому между правками в чате должно пройти не меньше
+    interval секунд — даже если в чате идут два ответа одновременно.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = {}             # chat_id -> monotonic-время, когда можно править
+
+    def ready(self, chat_id) -> bool:
+        """Можно ли править прямо сейчас (промежуточные правки просто пропускаются)."""
+        return time.monotonic() >= self._next.get(chat_id, 0.0)
+
+    def mark(self, chat_id):
+        self._next[chat_id] = time.monotonic() + self.interval
+        if len(self._next) > 10_000:
+            self._prune()
+
+    async def wait(self, chat_id):
+        """Дождаться права на правку (для финальной правки, которую нельзя пропустить)."""
+        while True:
+            delay = self._next.get(chat_id, 0.0) - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def _prune(self):
+        now = time.monotonic()
+        for chat_id in [c for c, t in self._next.items() if t <= now]:
+            del self._next[chat_id]
+
+
+_PUNCT = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def cache_key(text: str) -> str:
+    """
+    Ключ кэша ответов: сначала анонимизация (персональные данные никогда не
+    становятся ключом), затем регистр, ё/е, знаки препинания и пробелы.
+    "Меня ОБЗЫВАЮТ в чате!!!" и "меня обзывают в чате" дают один ключ.
+    """
+    t = anonymize_text(text).casefold().replace("ё", "е")
+    t = _PUNCT.sub(" ", t)
+    return _SPACES.sub(" ", t).strip()
+
+
+class ResponseCache:
+    """
+    LRU-кэш ответов модели с TTL.
+
+    Память ограничена и числом записей (max_entries), и суммарной длиной
+    ключей+ответов в символах (max_chars). Старые записи вытесняются первыми.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, max_chars: int = 2_000_000):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._chars = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: str):
+        size = len(key) + len(value)
+        if size > self.max_chars:
+            return
+        if key in self._data:
+            self._drop(key)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._chars += size
+        while len(self._data) > self.max_entries or self._chars > self.max_chars:
+            self._drop(next(iter(self._data)))
+            self.evictions += 1
+
+    def _drop(self, key: str):
+        _, value = self._data.pop(key)
+        self._chars -= len(key) + len(value)
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "ai_cache_entries": len(self._data),
+            "ai_cache_chars": self._chars,
+            "ai_cache_hits": self.hits,
+            "ai_cache_misses": self.misses,
+            "ai_cache_evictions": self.evictions,
+            "ai_cache_hit_ratio": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+# ---------- устойчивость: дедлайны, повторы, хеджирование, автомат-выключатель ----------
+
+class CircuitBreaker:
+    """
+    Автомат-выключатель для запросов к модели.
+
+    closed    — запросы идут как обычно; после failure_threshold ошибок подряд -> open.
+    open      — запросы не отправляются вообще (сразу запасной ответ);
+                через reset_timeout секунд -> half_open.
+    half_open — пропускается один пробный запрос: успех -> closed, ошибка -> open.
+
+    on_change(old, new) вызывается при каждой смене состояния.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, on_change=None):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self.rejected = 0
+
+    def _set(self, state: str):
+        if state != self.state:
+            old, self.state = self.state, state
+            if self.on_change is not None:
+                self.on_change(old, state)
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+            self._set(self.HALF_OPEN)
+            self._probe_started = None
+        if self.state == self.HALF_OPEN:
+            # Один пробный запрос; если он «потерялся» (например, не дождался
+            # слота), через reset_timeout пускаем следующий
+            if self._probe_started is None or now - self._probe_started >= self.reset_timeout:
+                self._probe_started = now
+                return True
+        if self.state != self.CLOSED:
+            self.rejected += 1
+            return False
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._set(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set(self.OPEN)
+
+    def metrics(self) -> dict:
+        return {
+            "ai_breaker_open": int(self.state != self.CLOSED),
+            "ai_breaker_failures": self.failures,
+            "ai_breaker_rejected": self.rejected,
+        }
+
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Временные ошибки: таймауты, сеть, 429/5xx от API."""
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if httpx is not None and isinstance(exc, httpx.TransportError):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    return code in RETRYABLE_CODES
+
+
+class ResilientCaller:
+    """
+    Выполняет запрос к модели с общим дедлайном, повторами и хеджированием.
+
+    deadline         — общий бюджет времени на все попытки, секунды;
+    retries          — сколько раз повторить после временной ошибки
+                       (пауза — экспоненциальная с полным джиттером);
+    hedge_percentile — если > 0 и попытка длится дольше этого перцентиля
+                       наблюдаемых задержек, параллельно запускается вторая,
+                       берётся первый успешный ответ;
+    limiter          — ConcurrencyLimiter, слот которого держит вызывающий:
+                       хедж занимает ещё один слот без ожидания, а если
+                       свободного нет — не запускается.
+    """
+
+    def __init__(self, deadline: float, retries: int, backoff: float = 0.5,
+                 hedge_percentile: float = 0.0, hedge_min_samples: int = 20,
+                 limiter: ConcurrencyLimiter = None):
+        self.deadline = deadline
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.limiter = limiter
+        self.latency = LatencyStats()
+
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedge_skipped = 0          # хедж не запущен: все слоты лимитера заняты
+        self.deadline_exceeded = 0
+
+    def _hedge_delay(self):
+        if self.hedge_percentile <= 0 or self.latency.count < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    async def _attempt(self, factory):
+        t0 = time.monotonic()
+        result = await factory()
+        self.latency.record(time.monotonic() - t0)
+        return result
+
+    async def _hedged(self, factory):
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._attempt(factory)
+
+        tasks = [asyncio.ensure_future(self._attempt(factory))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+
+            if self.limiter is not None and not await self.limiter.try_acquire():
+                self.hedge_skipped += 1
+                return await tasks[0]
+            self.hedged += 1
+            hedge = asyncio.ensure_future(self._attempt(factory))
+            if self.limiter is not None:
+                # Колбэк срабатывает и при отмене задачи до её старта
+                hedge.add_done_callback(lambda _: self.limiter.release())
+            tasks.append(hedge)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Проигравшая (или брошенная по дедлайну) попытка отменяется
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(self, factory):
+        """factory() — функция без аргументов, возвращающая новую корутину запроса."""
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline_at - loop.time()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                return await asyncio.wait_for(self._hedged(factory), timeout=remaining)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and loop.time() >= deadline_at:
+                    self.deadline_exceeded += 1
+                    raise
+                if attempt >= self.retries or not is_retryable(e):
+                    raise
+            attempt += 1
+            self.retried += 1
+            pause = random.uniform(0, self.backoff * (2 ** (attempt - 1)))
+            await asyncio.sleep(min(pause, max(0.0, deadline_at - loop.time())))
+
+    def metrics(self) -> dict:
+        m = self.latency.metrics("ai_call")
+        m.update({
+            "ai_retries": self.retried,
+            "ai_hedged": self.hedged,
+            "ai_hedge_wins": self.hedge_wins,
+            "ai_hedge_skipped": self.hedge_skipped,
+            "ai_deadline_exceeded": self.deadline_exceeded,
+        })
+        return m
+
+
+# ---------- память разговора в режиме ИИ ----------
+
+def approx_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (для кириллицы ~3 символа на токен)."""
+    return len(text) // 3 + 1
+
+
+class ConversationMemory:
+    """
+    История одного пользователя: кольцевой буфер реплик + краткая выжимка
+    того, что из буфера уже вытеснено. Хранится в HistoryStore по user_id.
+    """
+
+    __slots__ = ("key", "turns", "summary", "tokens")
+
+    def __init__(self, key=None):
+        self.key = key              # user_id
+        self.turns = deque()        # (role, text, tokens); role: "user" | "assistant"
+        self.summary = deque()      # (text, tokens) — сокращённые старые реплики пользователя
+        self.tokens = 0             # всего в turns + summary
+
+    def __len__(self):
+        return len(self.turns)
+
+    def render(self) -> str:
+        """Текст истории для промпта (пустая строка, если истории нет)."""
+        parts = []
+        if self.summary:
+            parts.append("Раньше пользователь рассказывал: " + " / ".join(t for t, _ in self.summary))
+        for role, text, _ in self.turns:
+            who = "Пользователь" if role == "user" else "Помощник"
+            parts.append(f"{who}: {text}")
+        return "\n".join(parts)
+
+
+class HistoryStore:
+    """
+    Управляет всеми ConversationMemory.
+
+    * у каждого пользователя не больше budget_tokens (реплики + выжимка);
+      старые реплики вытесняются в выжимку (только реплики пользователя,
+      сокращённые до summary_chars), выжимка — не больше summary_tokens;
+    * суммарно по всем пользователям не больше total_tokens: при превышении
+      целиком очищаются истории, к которым дольше всего не обращались.
+
+    Истории лежат здесь (user_id -> ConversationMemory), а не в
+    context.user_data: PTB перед каждым сохранением persistence делает
+    deepcopy user_data всех пользователей с апдейтами — прямо в event loop,
+    и копировать историю, которая всё равно не сохраняется, незачем.
+    """
+
+    def __init__(self, budget_tokens: int, total_tokens: int, turn_chars: int = 600,
+                 summary_tokens: int = 150, summary_chars: int = 100):
+        self.budget_tokens = budget_tokens
+        self.total_tokens = total_tokens
+        self.turn_chars = turn_chars
+        self.summary_tokens = summary_tokens
+        self.summary_chars = summary_chars
+        self._memories = {}         # user_id -> memory
+        self._lru = OrderedDict()   # user_id -> memory (только непустые)
+        self.used_tokens = 0
+        self.dropped = 0
+
+    def get(self, user_id) -> ConversationMemory:
+        memory = self._memories.get(user_id)
+        if memory is None:
+            memory = self._memories[user_id] = ConversationMemory(user_id)
+        if memory.tokens:
+            self._lru[user_id] = memory
+            self._lru.move_to_end(user_id)
+        return memory
+
+    def peek(self, user_id):
+        """История пользователя или None (новую не создаёт)."""
+        return self._memories.get(user_id)
+
+    def add(self, memory: ConversationMemory, role: str, text: str):
+        text = shorten_turn(anonymize_text(text), self.turn_chars)
+        if not text:
+            return
+        n = approx_tokens(text)
+        memory.turns.append((role, text, n))
+        self._grow(memory, n)
+
+        while memory.tokens > self.budget_tokens and len(memory.turns) > 1:
+            old_role, old_text, old_n = memory.turns.popleft()
+            self._grow(memory, -old_n)
+            if old_role == "user":
+                brief = shorten_turn(old_text, self.summary_chars)
+                bn = approx_tokens(brief)
+                memory.summary.append((brief, bn))
+                self._grow(memory, bn)
+            while memory.summary and sum(t for _, t in memory.summary) > self.summary_tokens:
+                _, sn = memory.summary.popleft()
+                self._grow(memory, -sn)
+
+        # История могла быть сброшена по общему лимиту, пока шёл запрос к ИИ
+        self._memories[memory.key] = memory
+        self._lru[memory.key] = memory
+        self._lru.move_to_end(memory.key)
+        self._enforce_total(keep=memory)
+
+    def clear(self, memory: ConversationMemory):
+        self._grow(memory, -memory.tokens)
+        memory.turns.clear()
+        memory.summary.clear()
+        self._lru.pop(memory.key, None)
+        self._memories.pop(memory.key, None)
+
+    def _grow(self, memory: ConversationMemory, n: int):
+        memory.tokens += n
+        self.used_tokens += n
+
+    def _enforce_total(self, keep: ConversationMemory):
+        while self.used_tokens > self.total_tokens and self._lru:
+            oldest = next(iter(self._lru.values()))
+            if oldest is keep:
+                break
+            self.clear(oldest)
+            self.dropped += 1
+
+    def metrics(self) -> dict:
+        return {
+            "ai_history_users": len(self._lru),
+            "ai_history_tokens": self.used_tokens,
+            "ai_history_dropped": self.dropped,
+        }
+
+
+def shorten_turn(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
@@ -0,0 +1,107 @@
+# bench/bench_anonymize.py
+"""
+Микро-бенчмарк и проверка эквивалентности анонимизатора.
+
+1) Генерирует случайный корпус «чатовых» сообщений на русском/казахском
+   с вкраплениями email, телефонов, @юзеров, ссылок и их «склеек».
+2) Проверяет, что anonymize_text совпадает с anonymize_text_reference
+   на каждом сообщении (при расхождении печатает пример и выходит с кодом 1).
+3) Сравнивает скорость.
+
+Запуск:
+  python bench/bench_anonymize.py
+  python bench/bench_anonymize.py --cases 200000 --seed 7
+"""
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anonymize import anonymize_text, anonymize_text_reference  # noqa: E402
+
+PHRASES = [
+    "меня обзывают в чате", "что делать если травят", "мне страшно идти в школу",
+    "одноклассники смеются надо мной", "никто со мной не разговаривает",
+    "маған сыныптастарым күледі", "мені мектепте мазақтайды", "не знаю кому рассказать",
+    "учитель не верит", "скинули мои фото в беседу", "привет", "спасибо", "ок",
+    "ёжик ёлка ЁЖ", "ну и что 😔", "👀👀", "я устал(а)", "помоги пожалуйста",
+]
+
+PII = [
+    "ivan.petrov@mail.ru", "a_b+c@gmail.com", "user@@x.kz", "mail@site", "@durov", "@кот_123",
+    "@12345678901", "+7 701 123 45 67", "8-777-123-45-67", "87011234567", "+7(701)1234567",
+    "2024 2025", "123", "1 2 3 4 5 6 7 8", "https://t.me/joinchat/abc", "http://x.kz/@abc",
+    "www.instagram.com/some.user", "https://vk.com/id1234567 89", "+7 701 123 4567user@mail.ru",
+    "@john.doe@mail.ru", "@abc1234 5678", "x@y.comhttp://z", "HTTP://UPPER.case", "wwwnot",
+    "тел:+77011234567,почта:qq@ww.ee", "id123456789@tg",
+]
+
+SEPARATORS = [" ", "  ", ", ", "\n", "", "\t", " — ", "!"]
+
+
+def make_message(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(1, 8)):
+        parts.append(rng.choice(PII) if rng.random() < 0.3 else rng.choice(PHRASES))
+        parts.append(rng.choice(SEPARATORS))
+    if rng.random() < 0.1:
+        parts.append("".join(rng.choice("0123456789 -+@.") for _ in range(rng.randint(1, 20))))
+    return "".join(parts)
+
+
+def make_corpus(n: int, seed: int, pii_share: float = 0.2) -> list:
+    """Реалистичная смесь: большинство сообщений без персональных данных."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        if rng.random() < pii_share:
+            corpus.append(make_message(rng))
+        else:
+            corpus.append(" ".join(rng.choice(PHRASES) for _ in range(rng.randint(1, 6))))
+    return corpus
+
+
+def check(corpus) -> int:
+    bad = 0
+    for text in corpus:
+        got, want = anonymize_text(text), anonymize_text_reference(text)
+        if got != want:
+            bad += 1
+            if bad <= 5:
+                print(f"РАСХОЖДЕНИЕ: {text!r}\n  new: {got!r}\n  ref: {want!r}")
+    return bad
+
+
+def bench(fn, corpus, repeat: int) -> float:
+    """Лучшее время на одно сообщение, мкс."""
+    best = min(timeit.repeat(lambda: [fn(t) for t in corpus], number=1, repeat=repeat))
+    return best / len(corpus) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cases", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # Проверка эквивалентности на «тяжёлом» корпусе (много PII и склеек)
+    hard = make_corpus(args.cases, args.seed, pii_share=1.0)
+    bad = check(hard)
+    print(f"Эквивалентность: {args.cases - bad}/{args.cases} совпадений")
+    if bad:
+        sys.exit(1)
+
+    for name, share in (("реалистичный (20% с PII)", 0.2), ("только с PII", 1.0)):
+        corpus = make_corpus(args.cases, args.seed + 1, pii_share=share)
+        ref = bench(anonymize_text_reference, corpus, args.repeat)
+        new = bench(anonymize_text, corpus, args.repeat)
+        print(f"{name:<26} эталон {ref:6.2f} мкс  новый {new:6.2f} мкс  ускорение x{ref / new:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# bench/bench_crisis.py
+"""
+Бенчмарк детектора кризисных фраз.
+
+Сравнивает на одном корпусе сообщений:
+  * старую регулярку CRISIS_REGEX (текущий набор фраз);
+  * регулярку-альтернацию по набору фраз, увеличенному в --scale раз;
+  * CrisisDetector (Ахо–Корасик) на текущем и увеличенном наборе.
+
+Дополнительно проверяет, что детектор находит всё, что находила старая
+регулярка (детектор может находить больше — за счёт нормализации).
+
+Каждый вариант замеряется --repeat раз (медиана / минимум); прогоны идут
+по кругу, чтобы фоновая нагрузка на машину одинаково влияла на все
+варианты. Цель: CrisisDetector на наборе фраз, увеличенном в --scale раз,
+не медленнее старой CRISIS_REGEX на текущем наборе. Сравниваются лучшие
+прогоны (минимум меньше всего зависит от шума); если отношение
+CRISIS_REGEX / CrisisDetector меньше --min-speedup, скрипт завершается
+с кодом 1 — удобно для CI.
+
+Запуск:
+  python bench/bench_crisis.py
+  python bench/bench_crisis.py --scale 10 --messages 20000
+  python bench/bench_crisis.py --min-speedup 2
+"""
+
+import argparse
+import random
+import re
+import statistics
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from crisis import CrisisDetector, DEFAULT_PHRASES_PATH, load_phrases  # noqa: E402
+
+LEGACY_REGEX = re.compile(
+    r"(хочу\s*умереть|покон(чить|чу)\s*с\s*собой|суицид|не\s*хочу\s*жить|"
+    r"kill\s*myself|suicide|self[-\s]*harm|умру\s*лучше)", re.IGNORECASE
+)
+
+WORDS = (
+    "меня обзывают в чате что делать если травят мне страшно идти в школу одноклассники "
+    "смеются надо мной никто со мной не разговаривает учитель не верит скинули фото беседу "
+    "маған сыныптастарым күледі мені мектепте мазақтайды привет спасибо хочу домой устал "
+    "жить умереть собой лучше хорошо плохо"
+).split()
+
+CRISIS_SAMPLES = [
+    "я больше не хочу жить", "хочу умереть", "думаю про суицид", "Покончу с собой",
+    "i want to kill myself", "self-harm again", "мен өлгім келеді",
+]
+
+CYRILLIC = "абвгдежзийклмнопрстуфхцчшщыэюяәғқңөұүһі"
+
+
+def synthetic_phrases(n: int, rng: random.Random) -> list:
+    """Правдоподобные по длине фразы из 2–3 «слов» для раздувания словаря."""
+    out = set()
+    while len(out) < n:
+        words = ["".join(rng.choice(CYRILLIC) for _ in range(rng.randint(3, 8)))
+                 for _ in range(rng.randint(2, 3))]
+        out.add(" ".join(words))
+    return sorted(out)
+
+
+def alternation(phrases) -> re.Pattern:
+    parts = [r"\s*".join(re.escape(w) for w in p.split()) for p in phrases]
+    return re.compile("(" + "|".join(parts) + ")", re.IGNORECASE)
+
+
+def make_corpus(n: int, rng: random.Random) -> list:
+    corpus = []
+    for _ in range(n):
+        msg = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 25)))
+        if rng.random() < 0.02:
+            msg += " " + rng.choice(CRISIS_SAMPLES)
+        corpus.append(msg)
+    return corpus
+
+
+def per_message_us(fns, corpus, repeat: int) -> list:
+    """Для каждой функции — мкс на сообщение в каждом из repeat прогонов."""
+    runs = [[] for _ in fns]
+    for _ in range(repeat):
+        for i, fn in enumerate(fns):
+            t = timeit.timeit(lambda: [fn(t) for t in corpus], number=1)
+            runs[i].append(t / len(corpus) * 1e6)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк детектора кризисных фраз")
+    parser.add_argument("--scale", type=int, default=10, help="во сколько раз увеличить словарь")
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-speedup", type=float, default=1.0,
+                        help="во сколько раз CrisisDetector на увеличенном наборе должен "
+                             "обгонять CRISIS_REGEX на текущем")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    base = load_phrases(DEFAULT_PHRASES_PATH)
+    big = base + synthetic_phrases(len(base) * (args.scale - 1), rng)
+    corpus = make_corpus(args.messages, rng)
+
+    det_base = CrisisDetector(base)
+    det_big = CrisisDetector(big)
+    regex_big = alternation(big)
+
+    missed = [t for t in corpus if LEGACY_REGEX.search(t) and not det_base.search(t)]
+    if missed:
+        print(f"Детектор пропустил {len(missed)} сообщений, которые ловит CRISIS_REGEX, например:")
+        print("  ", missed[0])
+        sys.exit(1)
+
+    avg_len = sum(map(len, corpus)) / len(corpus)
+    print(f"Сообщений: {len(corpus)}, средняя длина {avg_len:.0f} символов")
+    print(f"Фраз: {len(base)} (текущий словарь) и {len(big)} (x{args.scale})\n")
+
+    rows = [
+        ("CRISIS_REGEX (старая регулярка)", LEGACY_REGEX.search),
+        (f"регулярка, {len(big)} фраз", regex_big.search),
+        (f"CrisisDetector, {len(base)} фраз", det_base.search),
+        (f"CrisisDetector, {len(big)} фраз", det_big.search),
+    ]
+    best = []
+    for (name, _), runs in zip(rows, per_message_us([fn for _, fn in rows], corpus, args.repeat)):
+        best.append(min(runs))
+        print(f"{name:<36} {statistics.median(runs):7.2f} / {best[-1]:7.2f} мкс/сообщение")
+
+    legacy, regex_big_us, _, det_big_us = best
+    print(f"\nx{args.scale} фраз: CrisisDetector быстрее регулярки в {regex_big_us / det_big_us:.1f} раза")
+    speedup = legacy / det_big_us
+    print(f"CRISIS_REGEX ({len(base)} фраз) / CrisisDetector ({len(big)} фраз): {speedup:.2f}x "
+          f"(лучшие из {args.repeat} прогонов)")
+    if speedup < args.min_speedup:
+        print(f"Регрессия: CrisisDetector на x{args.scale} фраз медленнее цели "
+              f"({speedup:.2f}x < {args.min_speedup:.2f}x)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# bench/bench_replies.py
+"""
+Бенчмарк подготовки ответа на нажатие кнопки.
+
+Сравнивает, сколько стоит на один апдейт:
+  * старый путь — main_menu() создаёт 5 кнопок и InlineKeyboardMarkup,
+    шаблон выбирается цепочкой if/elif, PTB сериализует клавиатуру
+    (to_dict + json.dumps) при сборке запроса;
+  * новый путь — ответ берётся из REPLIES по таблице BUTTON_REPLIES,
+    клавиатура уже лежит в JSON и уходит в запрос как есть.
+
+В обоих случаях параметры собираются так же, как это делает Bot перед
+отправкой (RequestParameter/RequestData), сеть не используется.
+
+Запуск:
+  python bench/bench_replies.py
+  python bench/bench_replies.py --number 20000
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+from telegram.constants import ParseMode  # noqa: E402
+from telegram.request import RequestData  # noqa: E402
+from telegram.request._requestparameter import RequestParameter  # noqa: E402
+
+import main as bot  # noqa: E402
+
+
+def legacy_main_menu() -> InlineKeyboardMarkup:
+    """main_menu() до перехода на REPLIES."""
+    buttons = [
+        [InlineKeyboardButton("🙋 Я сталкиваюсь с буллингом", callback_data="p_self")],
+        [InlineKeyboardButton("👀 Я свидетель буллинга", callback_data="p_witness")],
+        [InlineKeyboardButton("⚖️ Права и куда обратиться", callback_data="p_rights")],
+        [InlineKeyboardButton("🆘 Экстренная помощь", callback_data="p_hotline")],
+        [InlineKeyboardButton("💬 Поговорить на другую тему (ИИ)", callback_data="chat_ai")],
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
+def legacy_params(key: str) -> dict:
+    if key == "p_self":
+        text = bot.TEMPLATES["p_self"]
+    elif key == "p_witness":
+        text = bot.TEMPLATES["p_witness"]
+    elif key == "p_rights":
+        text = bot.TEMPLATES["p_rights"]
+    elif key == "p_hotline":
+        text = bot.TEMPLATES["hotline"]
+    return {"chat_id": 1, "text": text, "parse_mode": ParseMode.HTML, "reply_markup": legacy_main_menu()}
+
+
+def new_params(key: str) -> dict:
+    reply = bot.REPLIES[bot.BUTTON_REPLIES[key]]
+    return {"chat_id": 1, "text": reply.text, "parse_mode": reply.parse_mode,
+            "reply_markup": reply.reply_markup}
+
+
+def serialize(params: dict) -> dict:
+    """То, что делает Bot._post перед отправкой."""
+    return RequestData([RequestParameter.from_input(k, v) for k, v in params.items()]).json_parameters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк подготовки ответа на кнопку")
+    parser.add_argument("--number", type=int, default=10_000, help="апдейтов в одном прогоне")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    keys = ["p_self", "p_witness", "p_rights", "p_hotline"] * (args.number // 4)
+
+    # Запросы должны совпадать по смыслу (JSON клавиатуры может отличаться форматированием)
+    for key in set(keys):
+        old, new = serialize(legacy_params(key)), serialize(new_params(key))
+        old["reply_markup"] = json.loads(old["reply_markup"])
+        new["reply_markup"] = json.loads(new["reply_markup"])
+        if old != new:
+            print("Ответы различаются для", key)
+            sys.exit(1)
+
+    def run(build, with_request):
+        if with_request:
+            return min(timeit.repeat(lambda: [serialize(build(k)) for k in keys], number=1, repeat=args.repeat))
+        return min(timeit.repeat(lambda: [build(k) for k in keys], number=1, repeat=args.repeat))
+
+    print(f"Апдейтов: {len(keys)}\n")
+    for name, with_request in (("только ответ", False), ("ответ + сборка запроса", True)):
+        old = run(legacy_params, with_request) / len(keys) * 1e6
+        new = run(new_params, with_request) / len(keys) * 1e6
+        print(f"{name:<24} было {old:6.2f} мкс  стало {new:6.2f} мкс  ускорение x{old / new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# bench/bench_startup.py
+"""
+Бенчмарк холодного старта.
+
+Каждый замер — новый процесс Python:
+  * импорт модулей (main, report, crisis) под `python -X importtime`:
+    общее время импорта и самые тяжёлые зависимости;
+  * «перезапуск до первого ответа»: процесс импортирует main, собирает
+    Application (build_app) с фальшивым транспортом Telegram
+    (bench/load_test.py), запускается и обрабатывает /start — время от
+    запуска процесса до отправки первого сообщения.
+
+--max-ms задаёт бюджет на импорт main: если медиана больше, скрипт
+завершается с кодом 1 (удобно для CI, чтобы ловить регрессии).
+
+Запуск:
+  python bench/bench_startup.py
+  python bench/bench_startup.py --runs 10 --top 15
+  python bench/bench_startup.py --max-ms 600
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MODULES = ("main", "report", "crisis")
+
+
+def child_env(tmp: Path) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "STATS_DIR": str(tmp / "stats"),
+        "STATE_DB": str(tmp / "state.sqlite3"),
+        "METRICS_PORT": "0",
+        "METRICS_DUMP_INTERVAL": "0",
+    })
+    return env
+
+
+def import_time(module: str, env: dict):
+    """(время импорта модуля в мс, [(накопленное мс, имя) для его прямых импортов])."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    total = 0.0
+    children = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue                        # строка заголовка
+        depth = len(name) - len(name.lstrip(" "))
+        ms = int(cumulative) / 1000
+        if name.strip() == module and depth == 1:
+            total = ms
+        elif depth == 3:
+            children.append((ms, name.strip()))
+    return total, sorted(children, reverse=True)
+
+
+def first_reply_time(env: dict) -> float:
+    """Секунды от запуска процесса до первого sendMessage в ответ на /start."""
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "--child"],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True,
+    )
+    line = proc.stdout.readline()
+    elapsed = time.perf_counter() - t0
+    proc.wait()
+    if line.strip() != "FIRST_REPLY":
+        raise RuntimeError(f"дочерний процесс не ответил: {line!r}")
+    return elapsed
+
+
+def child():
+    """Дочерний процесс для first_reply_time."""
+    sys.path.insert(0, str(ROOT))
+    sys.path.insert(0, str(ROOT / "bench"))
+    import main as bot
+    from load_test import FakeTelegram, text_update
+    from telegram import Update
+
+    class FirstReply(FakeTelegram):
+        async def do_request(self, url, method, request_data=None, **kwargs):
+            result = await super().do_request(url, method, request_data, **kwargs)
+            if url.endswith("/sendMessage") or url.endswith("/sendPhoto"):
+                print("FIRST_REPLY", flush=True)
+                os._exit(0)
+            return result
+
+    async def run():
+        app = bot.build_app("1:STARTUP", request=FirstReply(0, 0, 0))
+        await app.initialize()
+        await app.post_init(app)
+        await app.start()
+        update = text_update(1, 1, "/start")
+        update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}]
+        await app.update_queue.put(Update.de_json(update, app.bot))
+        await asyncio.sleep(30)
+
+    asyncio.run(run())
+    print("NO_REPLY", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="сколько тяжёлых импортов показать")
+    parser.add_argument("--max-ms", type=float, default=0, help="бюджет на импорт main, мс; 0 — без проверки")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    env = child_env(Path(tempfile.mkdtemp(prefix="bot-startup-")))
+    heavy = []
+    medians = {}
+    print(f"Прогонов: {args.runs} (медиана / минимум)\n")
+    for module in MODULES:
+        times = []
+        for _ in range(args.runs):
+            total, children = import_time(module, env)
+            times.append(total)
+        if module == "main":
+            heavy = children
+        medians[module] = statistics.median(times)
+        print(f"import {module:<8} {medians[module]:8.1f} мс / {min(times):8.1f} мс")
+
+    replies = [first_reply_time(env) * 1000 for _ in range(args.runs)]
+    print(f"\nзапуск процесса -> первый ответ на /start: "
+          f"{statistics.median(replies):.0f} мс / {min(replies):.0f} мс")
+
+    print("\nСамые тяжёлые импорты main (последний прогон):")
+    for ms, name in heavy[:args.top]:
+        print(f"  {ms:8.1f} мс  {name}")
+
+    if args.max_ms and medians["main"] > args.max_ms:
+        print(f"\nimport main: {medians['main']:.1f} мс > бюджета {args.max_ms:.0f} мс")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+# bench/load_test.py
+"""
+Нагрузочный тест бота без сети.
+
+Настоящее приложение (main.build_app: те же хэндлеры, очередь отправки,
+обработка апдейтов по чатам, состояние, статистика) получает поток
+синтетических апдейтов через update_queue. Вместо Telegram — фальшивый
+транспорт Bot API (FakeTelegram), вместо Gemini — фальшивый клиент
+(FakeGenai); у обоих задаётся задержка (логнормальная, медиана и разброс)
+и доля ошибок.
+
+Задержка апдейта — от постановки в очередь до конца обработки всеми
+хэндлерами. Печатается пропускная способность, p50/p95/p99 и максимальный
+хвост статистики (строки в памяти / задачи в потоке записи).
+
+Сценарии:
+  buttons — шторм нажатий кнопок меню;
+  ai      — наплыв сообщений в режиме ИИ (режим включается заранее, не в замере);
+  crisis  — кризисные фразы вперемешку с обычным текстом;
+  mixed   — всё вместе.
+
+Статистика и состояние пишутся во временную папку. Переменные окружения
+бота (UPDATE_CONCURRENCY, AI_MAX_CONCURRENCY, AI_STREAMING, ...) действуют
+как обычно; исходящая очередь по умолчанию выключена (--send-rate 0),
+иначе замер упрётся в лимиты Telegram (30 сообщений/с).
+
+Запуск:
+  python bench/load_test.py
+  python bench/load_test.py --scenario ai --updates 5000 --users 1000 --ai-latency 1.5 --ai-errors 0.05
+  python bench/load_test.py --scenario buttons --rate 500 --tg-latency 0.08
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+from crisis import DEFAULT_PHRASES_PATH, load_phrases  # noqa: E402
+
+SCENARIOS = ("buttons", "ai", "crisis", "mixed")
+BUTTONS = ("p_self", "p_witness", "p_rights", "p_hotline")
+GENERAL_TEXTS = (
+    "привет", "меня обижают в классе", "что делать, если надо мной смеются",
+    "мне грустно", "не знаю, кому рассказать", "спасибо",
+)
+
+
+def latency(median: float, spread: float) -> float:
+    """Логнормальная задержка: половина запросов быстрее median."""
+    if median <= 0:
+        return 0.0
+    return random.lognormvariate(math.log(median), spread)
+
+
+class FakeTelegram(BaseRequest):
+    """Транспорт Bot API без сети."""
+
+    def __init__(self, median: float, spread: float, errors: float):
+        self.median, self.spread, self.errors = median, spread, errors
+        self.calls = 0
+        self.failed = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "load_test_bot"}
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+        self.calls += 1
+        await asyncio.sleep(latency(self.median, self.spread))
+        if random.random() < self.errors:
+            self.failed += 1
+            return 502, b'{"ok":false,"error_code":502,"description":"Bad Gateway"}'
+        if endpoint.startswith("send") or endpoint.startswith("edit"):
+            chat = {"id": int(params.get("chat_id", 1)), "type": "private"}
+            result = {"message_id": self.calls, "date": int(time.time()), "chat": chat, "text": "ok"}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class FakeGenai:
+    """То, что бот использует от genai.Client: aio.models.generate_content(_stream)."""
+
+    def __init__(self, median: float, spread: float, errors: float, chunks: int = 5):
+        self.median, self.spread, self.errors, self.chunks = median, spread, errors, chunks
+        self.calls = 0
+        self.failed = 0
+        self.aio = SimpleNamespace(models=self)
+
+    def _fail(self) -> bool:
+        self.calls += 1
+        if random.random() < self.errors:
+            self.failed += 1
+            return True
+        return False
+
+    async def generate_content(self, model: str, contents: str):
+        await asyncio.sleep(latency(self.median, self.spread))
+        if self._fail():
+            raise RuntimeError("fake Gemini: 503 UNAVAILABLE")
+        return SimpleNamespace(text="Я тебя слышу. Расскажи взрослому, которому доверяешь. " * 3)
+
+    async def generate_content_stream(self, model: str, contents: str):
+        # Как в google-genai: корутина, которая возвращает async-итератор
+        return self._stream()
+
+    async def _stream(self):
+        total = latency(self.median, self.spread)
+        if self._fail():
+            await asyncio.sleep(total / 2)
+            raise RuntimeError("fake Gemini: 503 UNAVAILABLE")
+        for _ in range(self.chunks):
+            await asyncio.sleep(total / self.chunks)
+            yield SimpleNamespace(text="Я тебя слышу. ")
+
+
+# ---------- синтетические апдейты ----------
+
+def user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+
+def text_update(update_id: int, uid: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": uid, "type": "private"}, "from": user(uid),
+    }}
+
+
+def button_update(update_id: int, uid: int, data: str) -> dict:
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user(uid), "chat_instance": str(uid), "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Bot"}, "text": "menu"},
+    }}
+
+
+def make_updates(scenario: str, n: int, users: list, crisis_phrases: list, start_id: int) -> list:
+    out = []
+    for i in range(n):
+        uid = random.choice(users)
+        kind = scenario
+        if scenario == "mixed":
+            kind = random.choices(("buttons", "ai", "crisis", "general"), (4, 3, 1, 2))[0]
+        if kind == "buttons":
+            out.append(button_update(start_id + i, uid, random.choice(BUTTONS)))
+        elif kind == "crisis" and random.random() < 0.5:
+            out.append(text_update(start_id + i, uid, "мне плохо, " + random.choice(crisis_phrases)))
+        else:
+            out.append(text_update(start_id + i, uid, random.choice(GENERAL_TEXTS)))
+    return out
+
+
+def pct(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+# ---------- прогон ----------
+
+async def run_scenario(bot, args, scenario: str, user_base: int, tg: FakeTelegram, ai: FakeGenai) -> dict:
+    app = bot.build_app("1:LOADTEST", request=tg)
+    enqueued = {}
+    latencies = []
+    done = asyncio.Event()
+    expected = 0
+
+    async def finished(update, context):
+        # Группа 1: выполняется после всех хэндлеров группы 0 для этого апдейта
+        started = enqueued.pop(update.update_id, None)
+        if started is not None:
+            latencies.append(time.perf_counter() - started)
+            if len(latencies) >= expected:
+                done.set()
+
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    app.add_handler(TypeHandler(Update, finished), group=1)
+    app.add_error_handler(on_error)
+
+    users = [user_base + i for i in range(args.users)]
+    phrases = load_phrases(DEFAULT_PHRASES_PATH)
+
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    try:
+        async def feed(raw: list):
+            nonlocal expected
+            latencies.clear()
+            done.clear()
+            expected = len(raw)
+            interval = 1 / args.rate if args.rate > 0 else 0.0
+            t_start = time.perf_counter()
+            for i, data in enumerate(raw):
+                if interval:
+                    delay = t_start + i * interval - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                update = Update.de_json(data, app.bot)
+                enqueued[update.update_id] = time.perf_counter()
+                await app.update_queue.put(update)
+            await asyncio.wait_for(done.wait(), args.timeout)
+            return time.perf_counter() - t_start
+
+        if scenario in ("ai", "mixed"):
+            # Режим ИИ включается кнопкой до замера
+            await feed([button_update(user_base * 10 + i, uid, "chat_ai") for i, uid in enumerate(users)])
+            errors.clear()
+
+        backlog = {"queued": 0, "writer": 0, "ai_in_flight": 0}
+
+        async def sample():
+            while True:
+                m = bot.stats.metrics()
+                backlog["queued"] = max(backlog["queued"], m["queued_events"])
+                backlog["writer"] = max(backlog["writer"], m["writer_pending"])
+                backlog["ai_in_flight"] = max(backlog["ai_in_flight"], bot.ai_limiter.metrics()["ai_in_flight"])
+                await asyncio.sleep(0.01)
+
+        raw = make_updates(scenario, args.updates, users, phrases, user_base * 10 + len(users))
+        sampler = asyncio.create_task(sample())
+        ai_calls, ai_failed, tg_calls = ai.calls, ai.failed, tg.calls
+        try:
+            elapsed = await feed(raw)
+        finally:
+            sampler.cancel()
+    finally:
+        await app.stop()
+        await app.shutdown()
+        await app.post_shutdown(app)
+
+    values = sorted(latencies)
+    return {
+        "scenario": scenario,
+        "updates": len(values),
+        "seconds": elapsed,
+        "rps": len(values) / elapsed if elapsed else 0.0,
+        "p50_ms": pct(values, 0.50) * 1000,
+        "p95_ms": pct(values, 0.95) * 1000,
+        "p99_ms": pct(values, 0.99) * 1000,
+        "errors": len(errors),
+        "ai_calls": ai.calls - ai_calls,
+        "ai_failed": ai.failed - ai_failed,
+        "tg_calls": tg.calls - tg_calls,
+        "stats_queued_max": backlog["queued"],
+        "stats_writer_max": backlog["writer"],
+        "ai_in_flight_max": backlog["ai_in_flight"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота без сети")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--updates", type=int, default=500, help="апдейтов в сценарии")
+    parser.add_argument("--users", type=int, default=200, help="разных пользователей (чатов)")
+    parser.add_argument("--rate", type=float, default=0.0, help="апдейтов в секунду; 0 — все сразу")
+    parser.add_argument("--tg-latency", type=float, default=0.05, help="медиана ответа Telegram, с")
+    parser.add_argument("--tg-errors", type=float, default=0.0, help="доля ответов 502 от Telegram")
+    parser.add_argument("--ai-latency", type=float, default=0.8, help="медиана ответа Gemini, с")
+    parser.add_argument("--ai-errors", type=float, default=0.01, help="доля ошибок Gemini")
+    parser.add_argument("--spread", type=float, default=0.5, help="разброс задержек (sigma логнормали)")
+    parser.add_argument("--send-rate", type=float, default=0.0,
+                        help="SEND_RATE исходящей очереди; 0 — без лимитов Telegram")
+    parser.add_argument("--timeout", type=float, default=300.0, help="предел ожидания сценария, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="результат в JSON")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # Бот читает настройки при импорте: всё, что пишет на диск, — во временную папку
+    tmp = Path(tempfile.mkdtemp(prefix="bot-load-"))
+    os.environ["STATS_DIR"] = str(tmp / "stats")
+    os.environ["STATE_DB"] = str(tmp / "state.sqlite3")
+    os.environ["SEND_RATE"] = str(args.send_rate)
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["METRICS_DUMP_INTERVAL"] = "0"
+
+    import main as bot
+
+    tg = FakeTelegram(args.tg_latency, args.spread, args.tg_errors)
+    ai = FakeGenai(args.ai_latency, args.spread, args.ai_errors)
+    bot.client = ai
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+
+    async def run_all():
+        # Один event loop на все сценарии: объекты бота (лимитеры, очереди) создаются при импорте
+        return [await run_scenario(bot, args, scenario, i * 1_000_000, tg, ai)
+                for i, scenario in enumerate(scenarios, start=1)]
+
+    results = asyncio.run(run_all())
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"\nАпдейтов на сценарий: {args.updates}, пользователей: {args.users}, "
+          f"Telegram ~{args.tg_latency * 1000:.0f} мс, Gemini ~{args.ai_latency * 1000:.0f} мс, "
+          f"UPDATE_CONCURRENCY={bot.UPDATE_CONCURRENCY}, AI_MAX_CONCURRENCY={bot.AI_MAX_CONCURRENCY}\n")
+    print("Сценарий |  апд/с |  p50, мс |  p95, мс |  p99, мс | ошибок | вызовов ИИ | хвост статистики")
+    print("---------+--------+----------+----------+----------+--------+------------+-----------------")
+    for r in results:
+        print(f"{r['scenario']:<8} | {r['rps']:6.0f} | {r['p50_ms']:8.1f} | {r['p95_ms']:8.1f} | "
+              f"{r['p99_ms']:8.1f} | {r['errors']:6} | {r['ai_calls']:10} | "
+              f"{r['stats_queued_max']} строк / {r['stats_writer_max']} задач")
+
+
+if __name__ == "__main__":
+    main()
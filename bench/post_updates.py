@@ -0,0 +1,75 @@
+# bench/post_updates.py
+"""
+Отправка записанных апдейтов Telegram в бота, запущенного в режиме webhook.
+
+Файл — JSON-массив апдейтов или JSONL (один апдейт на строку), в том виде,
+в каком их присылает Telegram (getUpdates / webhook). Апдейты уходят
+по одному keep-alive соединению с заголовком секрета, в конце печатается
+сводка по кодам ответа.
+
+Запуск (бот: BOT_MODE=webhook python main.py):
+  python bench/post_updates.py updates.jsonl
+  python bench/post_updates.py updates.json --url http://127.0.0.1:8080/telegram --secret s3cr3t
+  python bench/post_updates.py updates.jsonl --repeat 100 --renumber
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlsplit
+
+
+def load_updates(path: Path) -> list:
+    text = Path(path).read_text(encoding="utf-8").strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("file", type=Path, help="JSON-массив или JSONL с апдейтами")
+    parser.add_argument("--url", default=os.getenv("WEBHOOK_LOCAL_URL", "http://127.0.0.1:8080/telegram"))
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--repeat", type=int, default=1, help="сколько раз отправить весь файл")
+    parser.add_argument("--renumber", action="store_true",
+                        help="выдавать апдейтам новые update_id (для --repeat)")
+    args = parser.parse_args()
+
+    updates = load_updates(args.file)
+    url = urlsplit(args.url)
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = args.secret
+
+    codes = Counter()
+    next_id = 1
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for update in updates:
+            if args.renumber:
+                update = dict(update, update_id=next_id)
+                next_id += 1
+            conn.request("POST", url.path or "/", body=json.dumps(update), headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            codes[resp.status] += 1
+    elapsed = time.perf_counter() - started
+    conn.close()
+
+    total = sum(codes.values())
+    print(f"Отправлено {total} апдейтов за {elapsed:.2f} с ({total / elapsed:.0f}/с)")
+    for status, n in sorted(codes.items()):
+        print(f"  HTTP {status}: {n}")
+    if set(codes) != {200}:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
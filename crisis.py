@@ -0,0 +1,167 @@
+# crisis.py
+"""
+Детектор кризисных фраз.
+
+Фразы грузятся из crisis_phrases.txt (или файла из CRISIS_PHRASES_PATH),
+нормализуются и собираются в автомат Ахо–Корасик, развёрнутый в полную
+таблицу переходов (DFA). Поиск — один проход по исходному тексту,
+на каждый символ один переход по словарю, независимо от числа фраз.
+
+Нормализация (одинаковая для фраз и сообщений):
+  * casefold;
+  * ё -> е, латинские буквы-двойники -> кириллица (a/а, o/о, p/р, ...);
+  * всё, что не буква, удаляется (пробелы, дефисы, цифры, знаки, эмодзи) —
+    как и в старой регулярке, где между словами стояло \\s*;
+  * повторяющиеся подряд буквы схлопываются ("хочууу" -> "хочу").
+
+Для сообщений нормализация не выполняется отдельным проходом — она встроена
+в таблицу переходов вместе с регистром (см. CrisisDetector.__init__). Цена — память: таблица
+растёт как (число состояний) x (алфавит), порядка нескольких МБ на сотню фраз.
+
+Бенчмарк: python bench/bench_crisis.py
+"""
+
+import os
+import re
+from pathlib import Path
+
+DEFAULT_PHRASES_PATH = Path(__file__).resolve().parent / "crisis_phrases.txt"
+
+# Латинские двойники кириллических букв (после casefold)
+_LOOKALIKES = {
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "i": "і", "k": "к",
+    "m": "м", "o": "о", "p": "р", "t": "т", "x": "х", "y": "у",
+    "ё": "е",
+}
+_TRANSLATE = str.maketrans(_LOOKALIKES)
+_ALIASES = {}
+for _src, _dst in _LOOKALIKES.items():
+    _ALIASES.setdefault(_dst, set()).add(_src)
+
+# Разделители, которые встречаются чаще всего; остальные не-буквы
+# обрабатываются в search() через str.isalpha()
+_SEPARATORS = " \t\n\r\xa0.,!?;:-–—…'\"«»()0123456789_"
+_NON_LETTERS = re.compile(r"[\W\d_]+")
+_REPEATS = re.compile(r"(.)\1+")
+
+
+def normalize(text: str) -> str:
+    t = (text or "").casefold().translate(_TRANSLATE)
+    t = _NON_LETTERS.sub("", t)
+    return _REPEATS.sub(r"\1", t)
+
+
+def _variants(ch: str) -> set:
+    """Все символы (в обоих регистрах), которые normalize() превращает в ch."""
+    out = set()
+    for v in {ch} | _ALIASES.get(ch, set()):
+        out.add(v)
+        upper = v.upper()
+        if len(upper) == 1 and upper.lower() == v:
+            out.add(upper)
+    return out
+
+
+def load_phrases(path: Path) -> list:
+    phrases = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            phrases.append(line)
+    return phrases
+
+
+class CrisisDetector:
+    """Поиск любой из фраз в тексте (Ахо–Корасик поверх normalize())."""
+
+    def __init__(self, phrases):
+        self.phrases = []
+        # Бор: goto[state] = {символ: state}, out[state] = индекс фразы или -1
+        goto = [{}]
+        out = [-1]
+        label = [""]                # последний символ пути до состояния
+        for phrase in phrases:
+            key = normalize(phrase)
+            if not key:
+                continue
+            state = 0
+            for ch in key:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(-1)
+                    label.append(ch)
+                state = nxt
+            if out[state] == -1:
+                out[state] = len(self.phrases)
+                self.phrases.append(phrase)
+
+        # Суффиксные ссылки (BFS) и сразу полная таблица переходов:
+        # delta[state] содержит все переходы, ведущие не в корень.
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])]
+        delta.extend({} for _ in range(len(goto) - 1))
+        order = list(goto[0].values())
+        i = 0
+        while i < len(order):
+            state = order[i]
+            i += 1
+            if out[state] == -1 and out[fail[state]] != -1:
+                out[state] = out[fail[state]]
+            # Переходы по суффиксной ссылке + собственные (перекрывают)
+            d = dict(delta[fail[state]])
+            d.update(goto[state])
+            delta[state] = d
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0)
+                order.append(nxt)
+
+        # Нормализацию «вшиваем» в таблицу, чтобы search() не строил новую строку:
+        #   * каждый переход дублируется для латинских двойников и для заглавных
+        #     букв (текст не копируется через lower());
+        #   * повтор той же буквы оставляет автомат на месте (схлопывание повторов);
+        #   * частые разделители тоже оставляют на месте (они удаляются normalize()).
+        # Переход в состояние с найденной фразой записан как len(delta) + индекс
+        # фразы: такого состояния нет, следующий шаг search() получит IndexError,
+        # и проверять out на каждом символе не нужно.
+        n = len(delta)
+        target = [s if o == -1 else n + o for s, o in enumerate(out)]
+        for state, d in enumerate(delta):
+            expanded = {}
+            for ch, nxt in d.items():
+                for v in _variants(ch):
+                    expanded[v] = target[nxt]
+            if state:
+                for v in _variants(label[state]):
+                    expanded[v] = target[state]
+                for sep in _SEPARATORS:
+                    expanded[sep] = target[state]
+            delta[state] = expanded
+
+        self._delta = delta
+
+    @classmethod
+    def from_file(cls, path: Path = None) -> "CrisisDetector":
+        path = path or os.getenv("CRISIS_PHRASES_PATH") or DEFAULT_PHRASES_PATH
+        return cls(load_phrases(path))
+
+    def search(self, text: str):
+        """Первая найденная фраза (в исходном написании) или None."""
+        delta = self._delta
+        state = 0
+        try:
+            for ch in text or "":
+                nxt = delta[state].get(ch)
+                if nxt is not None:
+                    state = nxt
+                elif ch.isalpha():
+                    state = 0
+                # Иначе редкий разделитель (эмодзи и т.п.): внутри фразы не рвёт
+                # совпадение, в корне автомат и так остаётся на месте
+        except IndexError:
+            pass                            # state — найденная фраза (см. __init__)
+        if state >= len(delta):
+            return self.phrases[state - len(delta)]
+        return None
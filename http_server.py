@@ -0,0 +1,129 @@
+# http_server.py
+"""
+Минимальный HTTP/1.1-сервер на asyncio (без новых зависимостей).
+
+HttpServer разбирает запросы (keep-alive, Content-Length, лимит тела),
+отвечает text/plain и умеет «мягко» останавливаться: close() перестаёт
+принимать соединения и дожидается уже начатых запросов. Что отвечать,
+решает подкласс в route() — см. webhook.WebhookServer.
+"""
+
+import asyncio
+
+MAX_BODY = 1 << 20              # апдейты Telegram намного меньше
+HEADER_TIMEOUT = 75.0           # простаивающее keep-alive соединение закрываем
+BODY_TIMEOUT = 10.0             # тело объявленной длины должно прийти за это время
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable",
+}
+
+
+class HttpServer:
+    """Соединения, разбор запросов и ответы; маршрутизация — в route()."""
+
+    def __init__(self, max_body: int = MAX_BODY):
+        self.max_body = max_body
+        self.draining = False
+        self._server = None
+        self._conns = set()             # открытые соединения (writer)
+        self._busy = set()              # соединения, которые сейчас обрабатывают запрос
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def route(self, method: str, target: str, headers: dict, body: bytes):
+        """(статус, текст ответа). body is None — тело больше max_body."""
+        raise NotImplementedError
+
+    # ---------- сервер ----------
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._serve, host, port)
+
+    async def close(self, timeout: float = 10.0, grace: float = 0.0):
+        """
+        Перестать принимать соединения и дождаться начатых запросов.
+
+        grace — сколько секунд после перехода в draining порт ещё принимает
+        соединения (каждое — на один запрос): балансировщик успевает увидеть
+        503 на /readyz и убрать реплику, прежде чем ей перестанут отвечать.
+        """
+        self.draining = True
+        if grace > 0:
+            await asyncio.sleep(grace)
+        if self._server is not None:
+            self._server.close()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        # Простаивающие keep-alive соединения закрываем сами
+        for writer in list(self._conns):
+            writer.close()
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    # ---------- HTTP ----------
+
+    async def _serve(self, reader, writer):
+        self._conns.add(writer)
+        try:
+            # В draining соединение обслуживает ещё один запрос и закрывается
+            # (keep_alive ниже сбрасывается) — так /readyz отвечает 503 во время grace
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body, keep_alive = request
+                self._busy.add(writer)
+                self._idle.clear()
+                try:
+                    status, payload = await self.route(method, target, headers, body)
+                    keep_alive = keep_alive and not self.draining
+                    await self._respond(writer, status, payload, keep_alive)
+                finally:
+                    self._busy.discard(writer)
+                    if not self._busy:
+                        self._idle.set()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._conns.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+        if not line:
+            return None
+        method, target, version = line.decode("latin-1").split()
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        if length > self.max_body:
+            # Тело не читаем: ответим 413 и закроем соединение
+            return method.upper(), target.split("?", 1)[0], headers, None, False
+        # Без таймаута клиент, приславший Content-Length и замолчавший,
+        # держал бы соединение вечно (и close() ждал бы его до конца)
+        body = await asyncio.wait_for(reader.readexactly(length), BODY_TIMEOUT) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body, keep_alive
+
+    async def _respond(self, writer, status: int, payload: str, keep_alive: bool):
+        body = payload.encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
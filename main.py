@@ -1,164 +1,465 @@
 # antibullying_bot.py
+import argparse
 import asyncio
+import copy
 import os
-import re
-import json
-import csv
+import threading
+import time
+from collections import deque
+from contextlib import aclosing
 from datetime import datetime
 from pathlib import Path
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup
-)
-from telegram.constants import ParseMode
+from telegram import Update
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     Application, CommandHandler, MessageHandler,
     CallbackQueryHandler, ContextTypes, filters
 )
 
+from ai_runtime import (
+    AiQueueTimeout, CircuitBreaker, ConcurrencyLimiter, ConversationMemory, EditThrottle,
+    HistoryStore, LatencyStats, ResilientCaller, ResponseCache, cache_key
+)
+from anonymize import anonymize_text
+from crisis import CrisisDetector
+from metrics import (
+    FAST_BUCKETS, HANDLER_BUCKETS, IO_BUCKETS, LAG_BUCKETS, LoopLagMonitor, MetricsRegistry
+)
+from stats_store import StatsBackend, ThreadedWriter, open_backend
+from persistence import SqlitePersistence
+from rate_limit import LANES, URGENT, PriorityRateLimiter
+from replies import ReplyRegistry, answer, keyboard_json, send
+from update_processor import PerChatUpdateProcessor
+import webhook
+
+# ===================== МЕТРИКИ ==============================================
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9321"))                  # GET /metrics; 0 — без сервера
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "60"))  # снимок в stats/metrics.json; 0 — нет
+
+registry = MetricsRegistry()
+HANDLER_SECONDS = registry.histogram(
+    "handler_seconds", "Время обработки апдейта хэндлером", HANDLER_BUCKETS, label="handler")
+AI_SECONDS = registry.histogram(
+    "ai_seconds", "Время полного ответа ИИ", HANDLER_BUCKETS, label="mode")
+CRISIS_SECONDS = registry.histogram(
+    "crisis_detect_seconds", "Время поиска кризисных фраз в сообщении", FAST_BUCKETS)
+STATS_WRITE_SECONDS = registry.histogram(
+    "stats_write_seconds", "Операции записи статистики в потоке записи", IO_BUCKETS, label="op")
+LOOP_LAG_SECONDS = registry.histogram(
+    "loop_lag_seconds", "Задержка event loop", LAG_BUCKETS)
+loop_lag = LoopLagMonitor(LOOP_LAG_SECONDS)
+
 # ===================== GEMINI (google-genai) ================================
 
-from google import genai
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# Необязательный адрес API (например, локальный фейковый сервер для тестов)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+# Сколько запросов к модели одновременно и сколько секунд можно ждать слот
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "10.0"))
+
+# Стриминг ответа: первое сообщение — сразу после первого куска текста,
+# дальше оно правится не чаще, чем раз в AI_EDIT_INTERVAL секунд на чат
+AI_STREAMING = os.getenv("AI_STREAMING", "0") == "1"
+AI_EDIT_INTERVAL = float(os.getenv("AI_EDIT_INTERVAL", "1.5"))
+
+# Кэш ответов на частые короткие сообщения ("меня обзывают в чате" и т.п.)
+AI_CACHE = os.getenv("AI_CACHE", "0") == "1"
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "1000"))       # записей
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "3600"))       # секунд
+AI_CACHE_MAX_KEY = int(os.getenv("AI_CACHE_MAX_KEY", "200"))  # длиннее — не кэшируем
+
+# Устойчивость к сбоям Gemini
+AI_DEADLINE = float(os.getenv("AI_DEADLINE", "25.0"))              # общий бюджет на ответ, с
+AI_RETRIES = int(os.getenv("AI_RETRIES", "2"))                     # повторы после 429/5xx/сети
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "0"))  # напр. 95; 0 — без хеджирования
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))   # ошибок подряд до размыкания
+AI_BREAKER_RESET = float(os.getenv("AI_BREAKER_RESET", "30.0"))    # секунд до пробного запроса
+
+# Память разговора: бюджет токенов на пользователя и общий потолок на все чаты
+AI_HISTORY_TOKENS = int(os.getenv("AI_HISTORY_TOKENS", "1000"))            # 0 — без памяти
+AI_HISTORY_TOTAL_TOKENS = int(os.getenv("AI_HISTORY_TOTAL_TOKENS", "5000000"))
+
+# genai.Client создаётся при первом запросе (get_client): импорт google.genai
+# занимает около полусекунды, а боту без ИИ, report.py и бенчмаркам он не нужен
+client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Клиент Gemini; ключ он возьмёт из GOOGLE_API_KEY/GEMINI_API_KEY."""
+    global client
+    if client is None:
+        with _client_lock:          # прогрев в потоке (on_startup) и первый запрос — не два клиента
+            if client is None:
+                from google import genai
+                client = genai.Client(http_options={"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None)
+    return client
+
+ai_limiter = ConcurrencyLimiter(AI_MAX_CONCURRENCY, AI_QUEUE_TIMEOUT)
+ai_ttft = LatencyStats()            # время до первого куска ответа (стриминг)
+ai_cache = ResponseCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+ai_caller = ResilientCaller(AI_DEADLINE, AI_RETRIES, hedge_percentile=AI_HEDGE_PERCENTILE,
+                            limiter=ai_limiter)
+
+def _on_breaker_change(old: str, new: str):
+    print(f"Gemini circuit breaker: {old} -> {new}")
+    stats.record("system", f"ai_breaker_{new}")
+
+ai_breaker = CircuitBreaker(AI_BREAKER_FAILURES, AI_BREAKER_RESET, on_change=_on_breaker_change)
+ai_history = HistoryStore(AI_HISTORY_TOKENS, AI_HISTORY_TOTAL_TOKENS)
+
+registry.collect(ai_limiter.metrics)
+registry.collect(lambda: ai_ttft.metrics("ai_ttft"))
+registry.collect(ai_caller.metrics)
+registry.collect(ai_breaker.metrics)
+registry.collect(ai_cache.metrics)
+registry.collect(ai_history.metrics)
+
+SYSTEM_RULES = (
+    "Ты — тёплый и поддерживающий помощник для детей и подростков, "
+    "которые сталкиваются с буллингом, тревогой, одиночеством или просто хотят поговорить.\n\n"
+    "Правила:\n"
+    "1. Пиши простым, человеческим языком, без диагнозов и сложных терминов.\n"
+    "2. В первую очередь признавай чувства пользователя.\n"
+    "3. Не поощряй месть, агрессию или саморазрушение.\n"
+    "4. Обязательно упоминай важность обращения к взрослым/психологу/администрации.\n"
+    "5. Отвечай по-русски.\n\n"
+)
+SYSTEM_PROMPT = SYSTEM_RULES + "Сообщение пользователя:\n"
+
+def build_contents(user_message: str, history: ConversationMemory = None) -> str:
+    """Промпт: правила + (если есть) история разговора + текущее сообщение."""
+    past = history.render() if history else ""
+    if not past:
+        return SYSTEM_PROMPT + user_message
+    return (
+        SYSTEM_RULES
+        + "История разговора (старые реплики сокращены):\n" + past + "\n\n"
+        + "Сообщение пользователя:\n" + user_message
+    )
+
+def remember(history: ConversationMemory, user_message: str, reply: str = None):
+    """Добавляет реплики в историю (ответ — только если это настоящий ответ модели)."""
+    if history is None or AI_HISTORY_TOKENS <= 0:
+        return
+    ai_history.add(history, "user", user_message)
+    if reply and reply not in (AI_EMPTY_REPLY, AI_ERROR_REPLY):
+        ai_history.add(history, "assistant", reply)
+
+# Если по какой-то причине текст пустой (safety / фильтр) —
+# даём свой сочувствующий ответ, а не "технические трудности".
+AI_EMPTY_REPLY = (
+    "Я слышу, что тебе нелегко в этой ситуации, даже если я сейчас не могу ответить так развернуто, "
+    "как хотелось бы.\n\n"
+    "То, что тебя обзывают в групповом чате, — это неприятно и несправедливо. "
+    "Ты не обязан это терпеть. Можно:\n"
+    "• Поговорить с человеком, которому доверяешь (родители, учитель, куратор, школьный психолог);\n"
+    "• Сохранить скриншоты и при необходимости показать их взрослым или администрации;\n"
+    "• Настроить приватность и при необходимости заблокировать обидчиков.\n\n"
+    "Если захочешь, расскажи чуть подробнее, что именно там происходит — я постараюсь подсказать шаги дальше."
+)
+
+# Ошибка или перегрузка — пользователь всё равно получает мягкий ответ
+AI_ERROR_REPLY = (
+    "Кажется, у меня сейчас технические трудности, и я не могу нормально использовать ИИ 😔\n\n"
+    "Но то, что ты написал(а), всё равно важно. "
+    "Ты можешь рассказать подробнее, что происходит, или выбрать одну из кнопок внизу. "
+    "Если ситуация очень тяжёлая или опасная — обязательно обратись к взрослым или на линию 150 / 112 / 103."
+)
 
-# Клиент возьмёт GEMINI_API_KEY из переменных окружения
-client = genai.Client()
+# Дописывается к ответу, если стрим оборвался после первого куска
+AI_CUT_OFF_NOTE = (
+    "\n\n…Ответ оборвался: у меня технические трудности 😔 "
+    "Если ситуация тяжёлая или опасная — обратись к взрослым или на линию 150 / 112 / 103."
+)
+
+async def _generate(contents: str):
+    """Нативный async-клиент SDK (client.aio), если он есть, иначе — поток."""
+    ai = get_client()
+    aio = getattr(ai, "aio", None)
+    if aio is not None:
+        return await aio.models.generate_content(model=GEMINI_MODEL, contents=contents)
+    return await asyncio.to_thread(
+        ai.models.generate_content,
+        model=GEMINI_MODEL,
+        contents=contents
+    )
+
+async def _generate_stream(contents: str):
+    """Куски ответа по мере генерации (async-итератор)."""
+    # google-genai 1.2.0 (см. requirements.txt): корутина, возвращающая async-итератор
+    stream = await get_client().aio.models.generate_content_stream(model=GEMINI_MODEL, contents=contents)
+    async for chunk in stream:
+        yield chunk
+
+async def ai_stream(user_message: str, history: ConversationMemory = None):
+    """
+    Стриминговый вариант ai_complete: отдаёт текст кусками.
+    Слот ConcurrencyLimiter занят, пока поток не дочитан или не закрыт.
+    Ошибки (включая AiQueueTimeout) пробрасываются — их обрабатывает вызывающий.
+    """
+    contents = build_contents(user_message, history)
+    async with ai_limiter.slot():
+        async with aclosing(_generate_stream(contents)) as chunks:
+            async for chunk in chunks:
+                text = getattr(chunk, "text", "") or ""
+                if text:
+                    yield text
+
+def ai_cache_key(user_message: str, history: ConversationMemory = None):
+    """
+    Ключ кэша или None, если сообщение кэшировать нельзя: кэш выключен,
+    уже есть история разговора (ответ зависит от контекста), сообщение
+    слишком длинное или похоже на кризисное (кризисный текст никогда
+    не получает ответ из кэша).
+    """
+    if not AI_CACHE or (history is not None and history.tokens):
+        return None
+    key = cache_key(user_message)
+    if not key or len(key) > AI_CACHE_MAX_KEY:
+        return None
+    if CRISIS_DETECTOR.search(user_message):
+        return None
+    return key
 
 # ОДНА функция для общения с ИИ
-async def ai_complete(user_message: str) -> str:
+@AI_SECONDS.time("complete")
+async def ai_complete(user_message: str, history: ConversationMemory = None) -> str:
     """
     Поддерживающий ответ от Gemini.
     Если Gemini вдруг не вернул текст или сработал фильтр — даём свой мягкий ответ.
+    Одновременно выполняется не больше AI_MAX_CONCURRENCY запросов; кто не
+    дождался слота за AI_QUEUE_TIMEOUT секунд, получает AI_ERROR_REPLY.
+    При AI_CACHE=1 ответы на частые короткие сообщения берутся из ai_cache.
+    Запрос идёт через ai_caller (дедлайн, повторы, хеджирование); пока
+    ai_breaker разомкнут, Gemini не вызывается и сразу отдаётся AI_ERROR_REPLY.
+    history — память разговора пользователя (HistoryStore); реплики
+    добавляются в неё после ответа.
     """
-    system_prompt = (
-        "Ты — тёплый и поддерживающий помощник для детей и подростков, "
-        "которые сталкиваются с буллингом, тревогой, одиночеством или просто хотят поговорить.\n\n"
-        "Правила:\n"
-        "1. Пиши простым, человеческим языком, без диагнозов и сложных терминов.\n"
-        "2. В первую очередь признавай чувства пользователя.\n"
-        "3. Не поощряй месть, агрессию или саморазрушение.\n"
-        "4. Обязательно упоминай важность обращения к взрослым/психологу/администрации.\n"
-        "5. Отвечай по-русски.\n\n"
-        "Сообщение пользователя:\n"
-    )
+    reply = await _ai_complete(user_message, history)
+    remember(history, user_message, reply)
+    return reply
+
+async def _ai_complete(user_message: str, history: ConversationMemory = None) -> str:
+    key = ai_cache_key(user_message, history)
+    if key is not None:
+        cached = ai_cache.get(key)
+        if cached is not None:
+            return cached
+
+    if not ai_breaker.allow():
+        return AI_ERROR_REPLY
 
-    contents = system_prompt + user_message
+    contents = build_contents(user_message, history)
 
     try:
-        resp = await asyncio.to_thread(
-            client.models.generate_content,
-            model="gemini-2.5-flash",
-            contents=contents
-        )
+        async with ai_limiter.slot():
+            resp = await ai_caller.call(lambda: _generate(contents))
+        ai_breaker.record_success()
 
         # Аккуратно достаём текст
         text = getattr(resp, "text", "") or ""
         text = text.strip()
 
         if text:
+            if key is not None:
+                ai_cache.put(key, text)
             return text
 
-        # Если по какой-то причине текст пустой (safety / фильтр) —
-        # даём свой сочувствующий ответ, а не "технические трудности".
-        return (
-            "Я слышу, что тебе нелегко в этой ситуации, даже если я сейчас не могу ответить так развернуто, "
-            "как хотелось бы.\n\n"
-            "То, что тебя обзывают в групповом чате, — это неприятно и несправедливо. "
-            "Ты не обязан это терпеть. Можно:\n"
-            "• Поговорить с человеком, которому доверяешь (родители, учитель, куратор, школьный психолог);\n"
-            "• Сохранить скриншоты и при необходимости показать их взрослым или администрации;\n"
-            "• Настроить приватность и при необходимости заблокировать обидчиков.\n\n"
-            "Если захочешь, расскажи чуть подробнее, что именно там происходит — я постараюсь подсказать шаги дальше."
-        )
+        return AI_EMPTY_REPLY
+
+    except AiQueueTimeout as e:
+        print("Gemini overloaded:", e)
+        return AI_ERROR_REPLY
 
     except Exception as e:
         # Лог в консоль, чтобы вы видели настоящую ошибку
         print("Gemini error:", repr(e))
-
-        # Пользователь всё равно получает мягкий ответ
-        return (
-            "Кажется, у меня сейчас технические трудности, и я не могу нормально использовать ИИ 😔\n\n"
-            "Но то, что ты написал(а), всё равно важно. "
-            "Ты можешь рассказать подробнее, что происходит, или выбрать одну из кнопок внизу. "
-            "Если ситуация очень тяжёлая или опасная — обязательно обратись к взрослым или на линию 150 / 112 / 103."
-        )
+        ai_breaker.record_failure()
+        return AI_ERROR_REPLY
 
 # ===================== СТАТИСТИКА / АНОНИМНОЕ ЛОГИРОВАНИЕ ===================
 
 STATS_DIR = Path(os.getenv("STATS_DIR", "stats"))
-STATS_DIR.mkdir(parents=True, exist_ok=True)
+STATS_BACKEND = os.getenv("STATS_BACKEND", "csv")  # csv | sqlite
+
+# Буферизация записи: события копятся в памяти и пишутся пачками
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "1.0"))    # секунды между сбросами
+STATS_BATCH_SIZE = int(os.getenv("STATS_BATCH_SIZE", "500"))              # макс. строк за одну запись
+STATS_CHECKPOINT_INTERVAL = float(os.getenv("STATS_CHECKPOINT_INTERVAL", "10.0"))  # counters.json не чаще
+STATS_CHECKPOINT_EVENTS = int(os.getenv("STATS_CHECKPOINT_EVENTS", "1000"))         # ...или каждые N событий
+# Только для csv: закрытые дни старше N дней сжимаются в stats/archive/*.csv.gz.
+# По умолчанию 0 — не сжимать: внешние скрипты могут читать stats/events_*.csv напрямую
+STATS_ARCHIVE_AFTER_DAYS = int(os.getenv("STATS_ARCHIVE_AFTER_DAYS", "0"))
+STATS_RETENTION_DAYS = int(os.getenv("STATS_RETENTION_DAYS", "0"))       # хранить дней; 0 — всегда
 
-def _today_csv_path() -> Path:
-    return STATS_DIR / f"events_{datetime.utcnow().strftime('%Y-%m-%d')}.csv"
+class StatsLogger:
+    """
+    Анонимное логирование: кнопки, сообщения, кризисные фразы.
 
-COUNTERS_PATH = STATS_DIR / "counters.json"
+    log_event только кладёт строку в очередь в памяти. Фоновая задача раз в
+    flush_interval (или раньше, если набралось batch_size строк) передаёт
+    пачку в поток записи (ThreadedWriter), который и работает с диском через
+    бэкенд (STATS_BACKEND: CsvBackend или SqliteBackend). counters.json сохраняется по
+    таймеру/числу событий, а не на каждое событие. close() дописывает всё,
+    что осталось в очереди.
 
-class StatsLogger:
-    """Анонимное логирование: кнопки, сообщения, кризисные фразы."""
-    def __init__(self):
-        self.lock = asyncio.Lock()
-        self._init_csv()
-        self.counters = self._load_counters()
-
-    def _init_csv(self):
-        p = _today_csv_path()
-        if not p.exists():
-            with p.open("w", newline="", encoding="utf-8") as f:
-                w = csv.writer(f)
-                w.writerow(["ts_utc", "type", "label", "text"])
-
-    def _load_counters(self):
-        if COUNTERS_PATH.exists():
+    loop_blocked_* — сколько времени event loop провёл внутри кода статистики.
+    """
+    def __init__(self, backend: StatsBackend = None,
+                 flush_interval: float = STATS_FLUSH_INTERVAL,
+                 batch_size: int = STATS_BATCH_SIZE,
+                 checkpoint_interval: float = STATS_CHECKPOINT_INTERVAL,
+                 checkpoint_events: int = STATS_CHECKPOINT_EVENTS,
+                 write_timer=None):
+        self.backend = backend      # None — откроется в _open() (start() или первое событие)
+        self._own_backend = backend is None     # свой бэкенд close() закрывает и забывает
+        self.write_timer = write_timer      # (seconds, операция) — длительность записи на диск
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_events = max(1, checkpoint_events)
+
+        self.queue = deque()
+        self.counters = None
+
+        self._io = None             # ThreadedWriter, создаётся в start()
+        self._wakeup = asyncio.Event()
+        self._writer_task = None
+        self._dirty = 0             # событий с последнего сохранения counters.json
+        self._last_checkpoint = time.monotonic()
+
+        self.loop_blocked_total = 0.0
+        self.loop_blocked_max = 0.0
+        self.loop_blocked_calls = 0
+
+    # ---------- фоновая запись ----------
+
+    def _blocked(self, t0: float):
+        dt = time.perf_counter() - t0
+        self.loop_blocked_total += dt
+        self.loop_blocked_calls += 1
+        if dt > self.loop_blocked_max:
+            self.loop_blocked_max = dt
+
+    def _open(self):
+        """Бэкенд и counters.json — при запуске бота, а не при импорте модуля."""
+        if self.backend is None:
+            self.backend = open_backend(STATS_BACKEND, STATS_DIR, STATS_ARCHIVE_AFTER_DAYS,
+                                        STATS_RETENTION_DAYS)
+        if self.counters is None:
+            self.counters = self.backend.load_counters()
+
+    def _ensure_io(self):
+        self._open()
+        if self._io is None:
+            self._io = ThreadedWriter(self.backend, on_done=self.write_timer)
+
+    def _flush(self):
+        """Передаёт очередь в поток записи пачками не больше batch_size."""
+        while self.queue:
+            n = min(len(self.queue), self.batch_size)
+            self._io.submit(self.backend.write_rows, [self.queue.popleft() for _ in range(n)])
+
+    def _maybe_checkpoint(self, force: bool = False):
+        if not self._dirty:
+            return
+        due = time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+        if force or due or self._dirty >= self.checkpoint_events:
+            self._io.submit(self.backend.save_counters, copy.deepcopy(self.counters))
+            self._dirty = 0
+            self._last_checkpoint = time.monotonic()
+
+    async def _writer(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            t0 = time.perf_counter()
+            self._flush()
+            self._maybe_checkpoint()
+            self._blocked(t0)
+
+    async def start(self, *_):
+        """Запускает поток и фоновую задачу записи (post_init приложения)."""
+        self._ensure_io()
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer())
+
+    async def close(self, *_):
+        """Останавливает запись и дожидается, пока всё попадёт на диск (post_shutdown)."""
+        if self._writer_task is not None:
+            self._writer_task.cancel()
             try:
-                return json.loads(COUNTERS_PATH.read_text(encoding="utf-8"))
-            except Exception:
+                await self._writer_task
+            except asyncio.CancelledError:
                 pass
+            self._writer_task = None
+        self._ensure_io()
+        self._flush()
+        self._maybe_checkpoint(force=True)
+        io, self._io = self._io, None
+        await asyncio.to_thread(io.close)
+        if self._own_backend:
+            # ThreadedWriter закрыл бэкенд: следующий start() (повторный
+            # post_init, как в bench/load_test.py) откроет его заново
+            self.backend = None
+            self.counters = None
+
+    def metrics(self) -> dict:
+        calls = self.loop_blocked_calls
         return {
-            "buttons": {
-                "p_self": 0, "p_witness": 0, "p_rights": 0,
-                "p_hotline": 0, "chat_ai": 0
-            },
-            "crisis_detected": 0,
-            "messages_total": 0,
-            "ai_messages": 0
+            "loop_blocked_total_ms": self.loop_blocked_total * 1000,
+            "loop_blocked_max_ms": self.loop_blocked_max * 1000,
+            "loop_blocked_avg_us": (self.loop_blocked_total / calls * 1e6) if calls else 0.0,
+            "queued_events": len(self.queue),
+            "writer_pending": self._io.pending() if self._io else 0,
         }
 
-    async def _save_counters(self):
-        tmp = COUNTERS_PATH.with_suffix(".json.tmp")
-        tmp.write_text(json.dumps(self.counters, ensure_ascii=False, indent=2), encoding="utf-8")
-        tmp.replace(COUNTERS_PATH)
+    # ---------- API ----------
 
     @staticmethod
     def anonymize_text(text: str) -> str:
-        """Маскируем email, телефоны, @юзеры, ссылки."""
-        t = text or ""
-        t = re.sub(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}", "[email]", t)
-        t = re.sub(r"(?:\+?\d[\d\-\s]{6,}\d)", "[phone]", t)
-        t = re.sub(r"@\w+", "@user", t)
-        t = re.sub(r"https?://\S+|www\.\S+", "[link]", t)
-        return t.strip()
+        """Маскируем email, телефоны, @юзеры, ссылки (см. anonymize.py)."""
+        return anonymize_text(text)
 
     async def log_event(self, event_type: str, label: str = "", text: str = ""):
+        self.record(event_type, label, text)
+
+    def record(self, event_type: str, label: str = "", text: str = ""):
+        """Синхронный вариант log_event — для колбэков вне корутин."""
+        t0 = time.perf_counter()
+        if self.counters is None:
+            self._open()
         atxt = self.anonymize_text(text)
         row = [datetime.utcnow().isoformat(timespec="seconds"), event_type, label, atxt]
-        async with self.lock:
-            self._init_csv()
-            with _today_csv_path().open("a", newline="", encoding="utf-8") as f:
-                csv.writer(f).writerow(row)
-            if event_type == "button" and label in self.counters["buttons"]:
-                self.counters["buttons"][label] += 1
-            if event_type == "crisis":
-                self.counters["crisis_detected"] += 1
-            if event_type == "message":
-                self.counters["messages_total"] += 1
-            if event_type == "message_ai":
-                self.counters["messages_total"] += 1
-                self.counters["ai_messages"] += 1
-            await self._save_counters()
-
-stats = StatsLogger()
+        self.queue.append(row)
+        if len(self.queue) >= self.batch_size:
+            self._wakeup.set()
+
+        if event_type == "button" and label in self.counters["buttons"]:
+            self.counters["buttons"][label] += 1
+        if event_type == "crisis":
+            self.counters["crisis_detected"] += 1
+        if event_type == "message":
+            self.counters["messages_total"] += 1
+        if event_type == "message_ai":
+            self.counters["messages_total"] += 1
+            self.counters["ai_messages"] += 1
+        self._dirty += 1
+        self._blocked(t0)
+
+stats = StatsLogger(write_timer=STATS_WRITE_SECONDS.observe)
+registry.collect(stats.metrics)
 
 # ===================== UI / ТЕКСТЫ ==========================================
 
@@ -177,15 +478,16 @@ DISCLAIMER = (
 
 HERO_IMAGE = None  # TODO: сюда можно поставить file_id или URL обложки
 
-def main_menu() -> InlineKeyboardMarkup:
-    buttons = [
-        [InlineKeyboardButton("🙋 Я сталкиваюсь с буллингом", callback_data="p_self")],
-        [InlineKeyboardButton("👀 Я свидетель буллинга", callback_data="p_witness")],
-        [InlineKeyboardButton("⚖️ Права и куда обратиться", callback_data="p_rights")],
-        [InlineKeyboardButton("🆘 Экстренная помощь", callback_data="p_hotline")],
-        [InlineKeyboardButton("💬 Поговорить на другую тему (ИИ)", callback_data="chat_ai")],
-    ]
-    return InlineKeyboardMarkup(buttons)
+# Кнопки главного меню: (текст кнопки, callback_data, ключ ответа в REPLIES).
+# Новая кнопка — это новая строка здесь и её текст в TEMPLATES.
+MENU = (
+    ("🙋 Я сталкиваюсь с буллингом", "p_self", "p_self"),
+    ("👀 Я свидетель буллинга", "p_witness", "p_witness"),
+    ("⚖️ Права и куда обратиться", "p_rights", "p_rights"),
+    ("🆘 Экстренная помощь", "p_hotline", "hotline"),
+    ("💬 Поговорить на другую тему (ИИ)", "chat_ai", "ai_on"),
+)
+MENU_MARKUP = keyboard_json([(label, data)] for label, data, _ in MENU)
 
 # Более длинные и сочувствующие тексты
 TEMPLATES = {
@@ -250,10 +552,8 @@ TEMPLATES = {
         "Там работают люди, которые умеют слушать и поддерживать."
 }
 
-CRISIS_REGEX = re.compile(
-    r"(хочу\s*умереть|покон(чить|чу)\s*с\s*собой|суицид|не\s*хочу\s*жить|"
-    r"kill\s*myself|suicide|self[-\s]*harm|умру\s*лучше)", re.IGNORECASE
-)
+# Кризисные фразы — в crisis_phrases.txt (можно переопределить CRISIS_PHRASES_PATH)
+CRISIS_DETECTOR = CrisisDetector.from_file()
 
 CRISIS_MESSAGE = (
     "⚠️ <b>Мне очень важно сказать тебе это.</b>\n\n"
@@ -268,50 +568,209 @@ CRISIS_MESSAGE = (
     "я постараюсь поддержать и помочь найти шаги дальше."
 )
 
+# Ответы собираются один раз при запуске; HTML проверяется здесь же.
+# Кризисный ответ и экстренная помощь обгоняют остальные в исходящей очереди
+URGENT_REPLIES = {"hotline", "crisis"}
+
+REPLIES = ReplyRegistry()
+REPLIES.add("disclaimer", DISCLAIMER, html=True, markup=MENU_MARKUP)
+for _key, _text in TEMPLATES.items():
+    REPLIES.add(_key, _text, html=True, markup=MENU_MARKUP, lane=URGENT if _key in URGENT_REPLIES else None)
+REPLIES.add("crisis", CRISIS_MESSAGE, html=True, markup=MENU_MARKUP, lane=URGENT)
+REPLIES.add(
+    "ai_on",
+    "Теперь можно просто писать мне, как человеку, — я постараюсь поддержать и ответить с помощью ИИ 💬\n\n"
+    "Если захочешь выключить этот режим, набери команду /stopchat.",
+    markup=MENU_MARKUP,
+)
+REPLIES.add(
+    "ai_off",
+    "Режим общения с ИИ выключен. "
+    "Можешь снова пользоваться кнопками внизу.",
+    markup=MENU_MARKUP,
+)
+REPLIES.add(
+    "general",
+    "Я здесь, чтобы поддержать. "
+    "Можешь выбрать одну из кнопок внизу или включить режим общения с ИИ (кнопка 💬).",
+    markup=MENU_MARKUP,
+)
+REPLIES.add(
+    "help",
+    "Команды:\n"
+    "/start — главное меню\n"
+    "/help — помощь\n"
+    "/stopchat — выйти из режима общения с ИИ",
+)
+REPLIES.add("unknown", "Я не знаю такую команду. Попробуй /start или /help.")
+
+# callback_data -> ключ ответа
+BUTTON_REPLIES = {data: reply for _, data, reply in MENU}
+
 AI_FLAG = "ai_chat_mode"
 
+def get_history(update: Update) -> ConversationMemory:
+    # История — в ai_history по user_id, не в context.user_data (см. HistoryStore)
+    if AI_HISTORY_TOKENS <= 0:
+        return None
+    return ai_history.get(update.effective_user.id)
+
 # ===================== ХЭНДЛЕРЫ =============================================
 
+edit_throttle = EditThrottle(AI_EDIT_INTERVAL)
+
+async def _send(message, text: str):
+    """
+    Первое сообщение стримингового ответа; None — Telegram его не принял.
+    Ошибки Telegram не считаются ошибками Gemini и не трогают ai_breaker.
+    """
+    try:
+        return await message.reply_text(text)
+    except TelegramError as e:
+        print("Send error:", repr(e))
+        return None
+
+async def _edit(sent, text: str) -> bool:
+    """True — правка дошла; иначе в конце ответа будет ещё одна попытка."""
+    try:
+        await sent.edit_text(text)
+        return True
+    except BadRequest as e:
+        # "Message is not modified" и т.п. — не повод ронять ответ
+        print("Edit error:", e)
+    except TelegramError as e:
+        print("Edit error:", repr(e))
+    return False
+
+@AI_SECONDS.time("stream")
+async def reply_ai_streaming(message, user_text: str, history: ConversationMemory = None):
+    """
+    Ответ ИИ со стримингом: первое сообщение уходит, как только пришёл
+    первый кусок текста, потом оно дописывается правками (не чаще, чем
+    позволяет edit_throttle для этого чата).
+    """
+    key = ai_cache_key(user_text, history)
+    if key is not None:
+        cached = ai_cache.get(key)
+        if cached is not None:
+            remember(history, user_text, cached)
+            await message.reply_text(cached)
+            return
+
+    if not ai_breaker.allow():
+        remember(history, user_text)
+        await message.reply_text(AI_ERROR_REPLY)
+        return
+
+    chat_id = message.chat_id
+    t0 = time.monotonic()
+    sent = None
+    text = shown = ""
+    failed = False
+    first = True
+    # AI_DEADLINE — только на время модели: ожидание в исходящей очереди
+    # Telegram (reply/edit между кусками) в бюджет не входит
+    model_time = 0.0
+
+    try:
+        async with aclosing(ai_stream(user_text, history)) as chunks:
+            while True:
+                started = time.monotonic()
+                try:
+                    async with asyncio.timeout(AI_DEADLINE - model_time):
+                        chunk = await anext(chunks)
+                except StopAsyncIteration:
+                    break
+                model_time += time.monotonic() - started
+                text += chunk
+                if not text.strip():
+                    continue
+                if first:
+                    first = False
+                    ai_ttft.record(time.monotonic() - t0)
+                if sent is None:
+                    # Если Telegram не принял сообщение, попробуем снова со следующим куском
+                    sent = await _send(message, text)
+                    if sent is not None:
+                        shown = text
+                    edit_throttle.mark(chat_id)
+                elif edit_throttle.ready(chat_id):
+                    edit_throttle.mark(chat_id)
+                    if await _edit(sent, text):
+                        shown = text
+        ai_breaker.record_success()
+    except AiQueueTimeout as e:
+        print("Gemini overloaded:", e)
+        failed = True
+    except Exception as e:
+        print("Gemini error:", repr(e))
+        ai_breaker.record_failure()
+        failed = True
+
+    text = text.strip()
+    if not text:
+        # Модель ничего не прислала — как и без стриминга, даём мягкий ответ
+        remember(history, user_text)
+        text = AI_ERROR_REPLY if failed else AI_EMPTY_REPLY
+    elif failed:
+        # Обрывок — не настоящий ответ: не запоминаем его и показываем, что ответ прерван
+        remember(history, user_text)
+        text += AI_CUT_OFF_NOTE
+    else:
+        remember(history, user_text, text)
+        if key is not None:
+            ai_cache.put(key, text)
+    if sent is None:
+        await message.reply_text(text)
+        return
+    if text != shown.strip():
+        await edit_throttle.wait(chat_id)
+        edit_throttle.mark(chat_id)
+        await _edit(sent, text)
+
+@HANDLER_SECONDS.time("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await stats.log_event("system", "start")
 
     # Можно отправить обложку + дисклеймер
+    reply = REPLIES["disclaimer"]
     if HERO_IMAGE:
         try:
             await update.effective_chat.send_photo(
                 photo=HERO_IMAGE,
-                caption=DISCLAIMER,
-                parse_mode=ParseMode.HTML,
-                reply_markup=main_menu()
+                caption=reply.text,
+                parse_mode=reply.parse_mode,
+                reply_markup=reply.reply_markup
             )
             return
         except Exception:
             pass
 
-    await update.effective_chat.send_message(
-        DISCLAIMER,
-        parse_mode=ParseMode.HTML,
-        reply_markup=main_menu()
-    )
+    await send(update.effective_chat, reply)
 
+@HANDLER_SECONDS.time("help_cmd")
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await stats.log_event("system", "help")
-    await update.message.reply_text(
-        "Команды:\n"
-        "/start — главное меню\n"
-        "/help — помощь\n"
-        "/stopchat — выйти из режима общения с ИИ"
-    )
+    await answer(update.message, REPLIES["help"])
 
+@HANDLER_SECONDS.time("stopchat_cmd")
 async def stopchat_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data[AI_FLAG] = False
+    history = ai_history.peek(update.effective_user.id)
+    if history is not None:
+        ai_history.clear(history)
     await stats.log_event("system", "stopchat")
-    await update.message.reply_text(
-        "Режим общения с ИИ выключен. "
-        "Можешь снова пользоваться кнопками внизу.",
-        reply_markup=main_menu()
-    )
+    await answer(update.message, REPLIES["ai_off"])
+
+def enable_ai(context):
+    context.user_data[AI_FLAG] = True
+
+# callback_data -> что сделать с состоянием пользователя перед ответом
+BUTTON_ACTIONS = {
+    "chat_ai": enable_ai,
+}
 
+@HANDLER_SECONDS.time("on_button")
 async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -319,63 +778,156 @@ async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await stats.log_event("button", key)
 
-    chat = query.message.chat
+    reply_key = BUTTON_REPLIES.get(key)
+    if reply_key is None:
+        return
+    action = BUTTON_ACTIONS.get(key)
+    if action is not None:
+        action(context)
 
     # ВАЖНО: отправляем НОВОЕ сообщение, а не edit_message_text
-    if key == "p_self":
-        await chat.send_message(TEMPLATES["p_self"], parse_mode=ParseMode.HTML, reply_markup=main_menu())
-    elif key == "p_witness":
-        await chat.send_message(TEMPLATES["p_witness"], parse_mode=ParseMode.HTML, reply_markup=main_menu())
-    elif key == "p_rights":
-        await chat.send_message(TEMPLATES["p_rights"], parse_mode=ParseMode.HTML, reply_markup=main_menu())
-    elif key == "p_hotline":
-        await chat.send_message(TEMPLATES["hotline"], parse_mode=ParseMode.HTML, reply_markup=main_menu())
-    elif key == "chat_ai":
-        context.user_data[AI_FLAG] = True
-        await chat.send_message(
-            "Теперь можно просто писать мне, как человеку, — я постараюсь поддержать и ответить с помощью ИИ 💬\n\n"
-            "Если захочешь выключить этот режим, набери команду /stopchat.",
-            reply_markup=main_menu()
-        )
+    await send(query.message.chat, REPLIES[reply_key])
 
+@HANDLER_SECONDS.time("on_text")
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_text = (update.message.text or "").strip()
 
     # Кризисные фразы
-    if CRISIS_REGEX.search(user_text):
+    t0 = time.perf_counter()
+    crisis = CRISIS_DETECTOR.search(user_text)
+    CRISIS_SECONDS.observe(time.perf_counter() - t0)
+    if crisis:
         await stats.log_event("crisis", "detected", text=user_text)
-        await update.message.reply_html(CRISIS_MESSAGE, reply_markup=main_menu())
+        await answer(update.message, REPLIES["crisis"])
         return
 
     # Режим общения с ИИ
     if context.user_data.get(AI_FLAG):
         await stats.log_event("message_ai", "free_chat", text=user_text)
-        reply = await ai_complete(user_text)
+        history = get_history(update)
+        if AI_STREAMING:
+            await reply_ai_streaming(update.message, user_text, history)
+            return
+        reply = await ai_complete(user_text, history)
         await update.message.reply_text(reply)
         return
 
     # Обычный текст без ИИ
     await stats.log_event("message", "general", text=user_text)
-    await update.message.reply_text(
-        "Я здесь, чтобы поддержать. "
-        "Можешь выбрать одну из кнопок внизу или включить режим общения с ИИ (кнопка 💬).",
-        reply_markup=main_menu()
-    )
+    await answer(update.message, REPLIES["general"])
 
+@HANDLER_SECONDS.time("on_unknown")
 async def on_unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await stats.log_event("system", "unknown_command")
-    await update.message.reply_text(
-        "Я не знаю такую команду. Попробуй /start или /help."
-    )
+    await answer(update.message, REPLIES["unknown"])
 
 # ===================== ЗАПУСК ===============================================
 
-def main():
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not token:
-        raise RuntimeError("Не задан TELEGRAM_BOT_TOKEN")
-
-    app = Application.builder().token(token).build()
+# polling — long polling (по умолчанию); webhook — встроенный HTTP-сервер (webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")           # заголовок X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")                 # публичный адрес; если задан — вызываем setWebhook
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25.0"))
+# Сколько секунд после SIGTERM /readyz отдаёт 503 при ещё открытом порте; 0 — закрыть сразу
+WEBHOOK_READY_GRACE = float(os.getenv("WEBHOOK_READY_GRACE", "5.0"))
+
+# Апдейты разных чатов обрабатываются параллельно, одного чата — по порядку
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))        # 1 — строго по одному
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1000"))      # в работе + ждут свой чат
+
+# Состояние пользователей между перезапусками (сохраняется только AI_FLAG;
+# история разговора с ИИ остаётся в памяти и на диск не пишется)
+STATE_DB = os.getenv("STATE_DB", "state/users.sqlite3")                # пусто — только в памяти
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "5.0"))  # секунд между записями
+STATE_SHARED = os.getenv("STATE_SHARED", "0") == "1"                   # несколько процессов на одном файле
+
+# Исходящая очередь: лимиты Telegram (сообщений в секунду) и повторы после RetryAfter
+SEND_RATE = float(os.getenv("SEND_RATE", "30"))                        # 0 — без очереди
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1.0"))             # личный чат
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))    # группа: 20 в минуту
+SEND_RETRIES = int(os.getenv("SEND_RETRIES", "2"))
+
+METRICS_FILE = STATS_DIR / "metrics.json"                              # снимок метрик для report.py
+metrics_server = None      # webhook.WebhookServer без приёма апдейтов: /healthz, /readyz, /metrics
+_metrics_dump_task = None
+_client_warmup = None
+
+async def _warm_up_client():
+    # Импорт google.genai и создание клиента — в потоке, пока бот уже отвечает
+    try:
+        await asyncio.to_thread(get_client)
+    except Exception as e:
+        print("Gemini: не удалось создать клиент:", repr(e))
+
+async def _dump_metrics_periodically():
+    while True:
+        await asyncio.sleep(METRICS_DUMP_INTERVAL)
+        # Снимок — в event loop (коллекторы не потокобезопасны), запись файла — в потоке
+        await asyncio.to_thread(registry.dump, METRICS_FILE, registry.snapshot())
+
+async def on_startup(app: Application):
+    global _metrics_dump_task, _client_warmup, metrics_server
+    await stats.start()
+    _client_warmup = asyncio.create_task(_warm_up_client())
+    loop_lag.start()
+    if METRICS_PORT:
+        metrics_server = webhook.WebhookServer(app, path=None, metrics=registry)
+        try:
+            await metrics_server.start(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            print(f"Метрики: не удалось открыть {METRICS_HOST}:{METRICS_PORT}:", e)
+    if METRICS_DUMP_INTERVAL > 0:
+        _metrics_dump_task = asyncio.create_task(_dump_metrics_periodically())
+
+async def on_shutdown(app: Application):
+    if _metrics_dump_task is not None:
+        _metrics_dump_task.cancel()
+    await loop_lag.stop()
+    if metrics_server is not None:
+        await metrics_server.close()
+    await stats.close()
+    if METRICS_DUMP_INTERVAL > 0:
+        registry.dump(METRICS_FILE)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=f"{BOT_NAME}: Telegram-бот")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=BOT_MODE,
+                        help="способ получения апдейтов (по умолчанию BOT_MODE или polling)")
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT, help="порт для режима webhook")
+    return parser.parse_args(argv)
+
+def build_app(token: str, request=None) -> Application:
+    """
+    Application со всеми хэндлерами и настройками из окружения.
+    request — свой транспорт Bot API (BaseRequest), например фальшивый
+    в bench/load_test.py; по умолчанию — обычный HTTP.
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if SEND_RATE > 0:
+        limiter = PriorityRateLimiter(SEND_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_RATE, SEND_RETRIES)
+        builder = builder.rate_limiter(limiter)
+        registry.collect(limiter.metrics, name="send_queue")
+    if STATE_DB:
+        state = SqlitePersistence(STATE_DB, keys=(AI_FLAG,), update_interval=STATE_FLUSH_INTERVAL,
+                                  shared=STATE_SHARED)
+        builder = builder.persistence(state)
+        registry.collect(state.metrics, name="state")
+    if UPDATE_CONCURRENCY > 1:
+        processor = PerChatUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING)
+        builder = builder.concurrent_updates(processor)
+        registry.collect(processor.metrics, name="updates")
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
@@ -383,9 +935,76 @@ def main():
     app.add_handler(CallbackQueryHandler(on_button))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
     app.add_handler(MessageHandler(filters.COMMAND, on_unknown))
+    return app
 
-    print(f"{BOT_NAME} запущен. Статистика: {STATS_DIR.resolve()}")
-    app.run_polling(close_loop=False)
+def main(argv=None):
+    args = parse_args(argv)
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise RuntimeError("Не задан TELEGRAM_BOT_TOKEN")
+
+    app = build_app(token)
+    limiter = app.bot.rate_limiter
+    state = app.persistence
+    processor = app.update_processor
+    if not isinstance(processor, PerChatUpdateProcessor):
+        processor = None
+
+    print(f"{BOT_NAME} запущен ({args.mode}). Статистика: {STATS_DIR.resolve()}")
+    if args.mode == "webhook":
+        server = asyncio.run(webhook.serve(
+            app, WEBHOOK_HOST, args.port, WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+            public_url=WEBHOOK_URL, drain_timeout=WEBHOOK_DRAIN_TIMEOUT, metrics=registry,
+            ready_grace=WEBHOOK_READY_GRACE,
+        ))
+        w = server.metrics()
+        print(f"Webhook: принято апдейтов {w['webhook_accepted']}, отклонено при остановке "
+              f"{w['webhook_rejected']}, некорректных {w['webhook_bad']}")
+    else:
+        app.run_polling(close_loop=False)
+
+    a = ai_limiter.metrics()
+    a.update(ai_ttft.metrics("ai_ttft"))
+    r = ai_caller.metrics()
+    print(f"ИИ: запросов {r['ai_call_count']}, p95 {r['ai_call_p95_ms']:.0f} мс, повторов {r['ai_retries']}, "
+          f"хеджей {r['ai_hedged']} (пропущено {r['ai_hedge_skipped']}), отказов автомата {ai_breaker.rejected}")
+    if AI_CACHE:
+        c = ai_cache.metrics()
+        print(f"ИИ: кэш ответов — попаданий {c['ai_cache_hits']}, промахов {c['ai_cache_misses']}, "
+              f"записей {c['ai_cache_entries']}")
+    if AI_HISTORY_TOKENS > 0:
+        h = ai_history.metrics()
+        print(f"ИИ: память разговоров — пользователей {h['ai_history_users']}, "
+              f"токенов ~{h['ai_history_tokens']}, сброшено по общему лимиту {h['ai_history_dropped']}")
+    if a["ai_ttft_count"]:
+        print(f"ИИ: время до первого куска ответа p50 {a['ai_ttft_p50_ms']:.0f} мс, "
+              f"p95 {a['ai_ttft_p95_ms']:.0f} мс")
+    print(
+        f"ИИ: макс. очередь {a['ai_queue_depth_max']}, ожидание слота в среднем "
+        f"{a['ai_queue_wait_avg_ms']:.1f} мс (макс. {a['ai_queue_wait_max_ms']:.1f} мс), "
+        f"таймаутов очереди {a['ai_queue_timeouts']}"
+    )
+    if limiter is not None:
+        q = limiter.metrics()
+        lanes = ", ".join(
+            f"{name} p95 {q[f'send_wait_{name}_p95_ms']:.0f} мс ({q[f'send_wait_{name}_count']})"
+            for name in LANES
+        )
+        print(f"Исходящая очередь: {lanes}; макс. глубина {q['send_queue_depth_max']}, "
+              f"RetryAfter {q['send_retry_after']}")
+    if state is not None:
+        p = state.metrics()
+        print(f"Состояние: загружено {p['state_loads']}, записано {p['state_writes']} "
+              f"пачками ({p['state_batches']})")
+    if processor is not None:
+        u = processor.metrics()
+        print(f"Апдейты: одновременно макс. {u['updates_active_max']} (лимит {UPDATE_CONCURRENCY}), "
+              f"ждали свой чат {u['updates_chat_waits']} раз")
+    m = stats.metrics()
+    print(
+        f"Статистика: event loop занят записью {m['loop_blocked_total_ms']:.1f} мс всего, "
+        f"макс. {m['loop_blocked_max_ms']:.3f} мс, в среднем {m['loop_blocked_avg_us']:.1f} мкс на вызов"
+    )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,210 @@
+# metrics.py
+"""
+Метрики бота в формате Prometheus (text exposition 0.0.4).
+
+Histogram — гистограмма с фиксированными корзинами и необязательной меткой
+(например, handler="on_text"). observe() — bisect по корзинам и пара
+сложений под замком, так что гистограммы можно держать включёнными
+в продакшене и наполнять из потоков (запись статистики).
+
+MetricsRegistry собирает гистограммы и «коллекторы» — функции, которые
+возвращают словарь чисел (metrics() лимитера ИИ, очереди отправки и т.п.);
+их значения отдаются как gauge bot_<ключ>. Снимок можно:
+  * отдать по HTTP: GET /metrics (webhook.WebhookServer, в том числе в режиме polling);
+  * сохранить в JSON (dump) — его читает report.py.
+
+LoopLagMonitor — задержка event loop: насколько позже заказанного
+просыпается asyncio.sleep(interval).
+"""
+
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from pathlib import Path
+
+# Корзины, секунды
+HANDLER_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FAST_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2)
+IO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Гистограмма длительностей (секунды) с необязательной меткой."""
+
+    def __init__(self, name: str, help: str, buckets, label: str = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.label = label
+        self._series = {}           # значение метки -> [счётчики по корзинам (+Inf в конце), сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, label_value: str = ""):
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += seconds
+
+    def time(self, label_value: str = ""):
+        """Декоратор для корутин: время выполнения попадает в гистограмму."""
+        def decorator(fn):
+            @wraps(fn)
+            async def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - t0, label_value)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                value: {"counts": list(counts), "sum": total}
+                for value, (counts, total) in self._series.items()
+            }
+
+    def render(self, out: list):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} histogram")
+        for value, s in sorted(self.snapshot().items()):
+            label = f'{self.label}="{value}"' if self.label else ""
+            sep = "," if label else ""
+            running = 0
+            for bound, n in zip(self.buckets + (math.inf,), s["counts"]):
+                running += n
+                out.append(f'{self.name}_bucket{{{label}{sep}le="{_fmt(bound)}"}} {running}')
+            braces = f"{{{label}}}" if label else ""
+            out.append(f"{self.name}_sum{braces} {_fmt(s['sum'])}")
+            out.append(f"{self.name}_count{braces} {running}")
+
+
+def quantile(buckets, counts, q: float) -> float:
+    """Оценка квантиля по корзинам (линейно внутри корзины, как histogram_quantile)."""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    lower = 0.0
+    for bound, n in zip(list(buckets) + [math.inf], counts):
+        if seen + n >= rank and n:
+            if bound == math.inf:
+                return lower
+            return lower + (bound - lower) * (rank - seen) / n
+        seen += n
+        lower = bound if bound != math.inf else lower
+    return lower
+
+
+class MetricsRegistry:
+    """Гистограммы + коллекторы gauge-значений."""
+
+    def __init__(self, prefix: str = "bot_"):
+        self.prefix = prefix
+        self.histograms = []
+        self._collectors = {}           # имя (или сама функция) -> fn
+
+    def histogram(self, name: str, help: str, buckets, label: str = None) -> Histogram:
+        h = Histogram(self.prefix + name, help, buckets, label)
+        self.histograms.append(h)
+        return h
+
+    def collect(self, fn, name: str = None):
+        """
+        fn() -> {имя: число}; вызывается при каждом снимке.
+
+        С name повторная регистрация заменяет прежний коллектор: объекты,
+        которые build_app() создаёт заново (лимитер, persistence), не
+        копятся в реестре при каждой сборке Application.
+        """
+        self._collectors[name or fn] = fn
+
+    def gauges(self) -> dict:
+        out = {}
+        for fn in list(self._collectors.values()):
+            try:
+                values = fn()
+            except Exception as e:
+                print("Metrics collector error:", repr(e))
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    out[self.prefix + key] = value
+        return out
+
+    def render(self) -> str:
+        out = []
+        for h in self.histograms:
+            h.render(out)
+        for name, value in sorted(self.gauges().items()):
+            out.append(f"# TYPE {name} gauge")
+            out.append(f"{name} {_fmt(value)}")
+        return "\n".join(out) + "\n"
+
+    def snapshot(self) -> dict:
+        return {
+            "ts": time.time(),
+            "histograms": {
+                h.name: {"label": h.label, "buckets": list(h.buckets), "series": h.snapshot()}
+                for h in self.histograms
+            },
+            "gauges": self.gauges(),
+        }
+
+    def dump(self, path: Path, snapshot: dict = None):
+        """
+        Атомарно записывает снимок в JSON (для report.py). Снимок лучше снять
+        в event loop и передать сюда, а саму запись выполнить в потоке.
+        """
+        snapshot = snapshot if snapshot is not None else self.snapshot()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(json.dumps(snapshot, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+class LoopLagMonitor:
+    """Фоновая задача: задержка event loop -> гистограмма."""
+
+    def __init__(self, histogram: Histogram, interval: float = 0.5):
+        self.histogram = histogram
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.histogram.observe(max(0.0, time.perf_counter() - t0 - self.interval))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
@@ -0,0 +1,231 @@
+# persistence.py
+"""
+Хранение состояния пользователей (context.user_data) между перезапусками.
+
+SqlitePersistence — BasePersistence из python-telegram-bot поверх одного
+файла SQLite (WAL). Хранится только user_data, и только выбранные ключи
+(например, AI_FLAG): значения сериализуются в компактный JSON, пустое
+состояние — это отсутствие строки.
+
+  * Ленивая загрузка. get_user_data() при старте возвращает пустой словарь,
+    поэтому запуск не зависит от числа пользователей. Состояние читается
+    одним запросом по первичному ключу в refresh_user_data(), который PTB
+    вызывает перед обработкой апдейта пользователя. Запрос выполняется в
+    потоке через отдельное соединение только для чтения: в WAL оно не ждёт
+    пачку записи или checkpoint, и event loop не блокируется.
+  * Пакетная запись. PTB вызывает update_user_data() раз в update_interval
+    секунд для пользователей, у которых были апдейты, — это и есть «дебаунс».
+    Записываются только те, у кого сохраняемая часть реально изменилась,
+    одной транзакцией в потоке, event loop не блокируется. При остановке
+    flush() дописывает остаток.
+  * Несколько процессов (shared=True). Каждый refresh сверяет версию строки
+    и перечитывает состояние, если его изменил другой процесс. Ещё не
+    записанные локальные изменения при этом не затираются.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+
+class SqlitePersistence(BasePersistence):
+    """user_data в SQLite: ленивое чтение, пакетная запись."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id    INTEGER PRIMARY KEY,
+            data       TEXT NOT NULL,
+            version    INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: Path, keys=None, update_interval: float = 5.0, shared: bool = False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = Path(path)
+        self.keys = frozenset(keys) if keys else None
+        self.shared = shared
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Читает event loop, пишет поток из asyncio.to_thread — доступ через замок
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        # Чтение для refresh_user_data: своё соединение и свой замок (только между читателями)
+        self.reader = sqlite3.connect(f"file:{self.path.resolve()}?mode=ro", uri=True,
+                                      check_same_thread=False)
+        self._read_lock = threading.Lock()
+        self._known = {}            # user_id -> (версия, JSON), которые мы видели/записали
+        self._pending = {}          # user_id -> JSON или None (удалить)
+        self._inflight = {}         # пачка, которую сейчас пишет поток
+        self._writer = None
+        # Метрики
+        self.loads = 0
+        self.writes = 0
+        self.batches = 0
+
+    # ---------- кодирование ----------
+
+    def _encode(self, data: dict):
+        if self.keys is not None:
+            data = {k: v for k, v in data.items() if k in self.keys}
+        data = {k: v for k, v in data.items() if v not in (None, False, "", [], {})}
+        if not data:
+            return None
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+    # ---------- чтение ----------
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._pending or user_id in self._inflight:
+            return                  # локальные изменения ещё не записаны — они новее
+        known = self._known.get(user_id)
+        if known is not None and not self.shared:
+            return
+        row = await asyncio.to_thread(self._read, user_id)
+        if user_id in self._pending or user_id in self._inflight or self._known.get(user_id) is not known:
+            return                  # пока читали, появились локальные изменения или запись — они новее
+        version = row[0] if row else 0
+        if known is not None and version == known[0]:
+            return
+        self._known[user_id] = (version, row[1] if row else None)
+        self.loads += 1
+        if self.keys is not None:
+            for key in self.keys:
+                user_data.pop(key, None)
+        else:
+            user_data.clear()
+        if row:
+            user_data.update(json.loads(row[1]))
+
+    def _read(self, user_id: int):
+        with self._read_lock:
+            return self.reader.execute(
+                "SELECT version, data FROM user_state WHERE user_id = ?", (user_id,)
+            ).fetchone()
+
+    # ---------- запись ----------
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        # PTB отмечает каждого пользователя, у которого был апдейт; пишем только
+        # если сохраняемая часть состояния действительно изменилась
+        encoded = self._encode(data)
+        known = self._known.get(user_id)
+        unsaved = user_id in self._pending or user_id in self._inflight
+        if not unsaved and encoded == (known[1] if known else None):
+            return
+        self._pending[user_id] = encoded
+        self._schedule()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending[user_id] = None
+        self._schedule()
+
+    def _schedule(self):
+        # update_user_data вызывается для всех изменившихся пользователей в одном
+        # проходе; запись стартует после них и забирает их одной пачкой.
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        await asyncio.sleep(0)
+        while self._pending:
+            batch = self._inflight = self._pending
+            self._pending = {}
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except sqlite3.Error as e:
+                print("Ошибка записи состояния пользователей:", repr(e))
+                # Не теряем изменения: вернём то, что не перезаписано новыми
+                for user_id, data in batch.items():
+                    self._pending.setdefault(user_id, data)
+                return
+            finally:
+                self._inflight = {}
+
+    def _write_batch(self, batch: dict):
+        now = time.time()
+        known = {}
+        with self._lock, self.conn:
+            for user_id, data in batch.items():
+                if data is None:
+                    self.conn.execute("DELETE FROM user_state WHERE user_id = ?", (user_id,))
+                    known[user_id] = (0, None)
+                    continue
+                row = self.conn.execute(
+                    "INSERT INTO user_state (user_id, data, version, updated_at) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, "
+                    "version = user_state.version + 1, updated_at = excluded.updated_at "
+                    "RETURNING version",
+                    (user_id, data, now),
+                ).fetchone()
+                known[user_id] = (row[0], data)
+        self._known.update(known)
+        self.writes += len(batch)
+        self.batches += 1
+
+    async def flush(self) -> None:
+        if self._writer is not None:
+            await self._writer
+        if self._pending:
+            batch, self._pending = self._pending, {}
+            self._write_batch(batch)
+        with self._lock:
+            self.conn.close()
+        with self._read_lock:
+            self.reader.close()
+
+    def metrics(self) -> dict:
+        return {
+            "state_loads": self.loads,
+            "state_writes": self.writes,
+            "state_batches": self.batches,
+            "state_users_seen": len(self._known),
+        }
+
+    # ---------- не используется (store_data: только user_data) ----------
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
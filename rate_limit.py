@@ -0,0 +1,221 @@
+# rate_limit.py
+"""
+Исходящая очередь запросов к Telegram с учётом лимитов Bot API.
+
+PriorityRateLimiter — BaseRateLimiter из python-telegram-bot, через него
+проходят все запросы бота (send_message, reply_text, edit_text, ...),
+поэтому хэндлеры ничего не знают об очереди.
+
+  * Токен-бакеты: общий (по умолчанию 30 сообщений/с) и на каждый чат
+    (личный чат — 1/с с небольшим запасом на всплеск, группа — 20/мин).
+    Запрос уходит, только когда есть токен в обоих.
+  * Полосы приоритета: urgent (кризисный ответ, экстренная помощь),
+    normal (обычные ответы), bulk (правки при стриминге, рассылки).
+    Свободный токен всегда получает запрос из более срочной полосы;
+    чат, у которого кончились токены, не задерживает другие чаты.
+  * RetryAfter: чат и общий бакет «замораживаются» на retry_after секунд,
+    запрос повторяется (до max_retries раз), хэндлер исключения не видит.
+  * Задержка в очереди считается по каждой полосе (LatencyStats).
+
+Полоса задаётся так: rate_limit_args={"lane": "urgent"} в методе бота,
+или на время вызова через lane("urgent") (contextvars — работает и для
+коротких форм вроде chat.send_message). По умолчанию edit* идут в bulk,
+остальное — в normal. Запросы без chat_id (answerCallbackQuery, getMe,
+setWebhook, ...) лимитами на сообщения не ограничены и идут сразу.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from ai_runtime import LatencyStats
+
+URGENT, NORMAL, BULK = "urgent", "normal", "bulk"
+LANES = (URGENT, NORMAL, BULK)
+_PRIORITY = {name: i for i, name in enumerate(LANES)}
+
+_LANE = contextvars.ContextVar("send_lane", default=None)
+
+
+@contextmanager
+def lane(name: str):
+    """Запросы к Telegram внутри блока идут в полосу name."""
+    token = _LANE.set(name)
+    try:
+        yield
+    finally:
+        _LANE.reset(token)
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp", "paused_until")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+        self.paused_until = 0.0
+
+    def refill(self, now: float):
+        if now > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def ready(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= 1 and now >= self.paused_until
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд появится токен."""
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        return max(wait, self.paused_until - now)
+
+    def pause(self, now: float, seconds: float):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """Общий и поканальный лимиты, полосы приоритета, повтор после RetryAfter."""
+
+    def __init__(self, overall_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, max_retries: int = 2):
+        self.overall_rate = overall_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(overall_rate, overall_rate, time.monotonic())
+        self._chats = {}                # chat_id -> TokenBucket
+        self._heap = []                 # (приоритет, номер, chat_id, future)
+        self._seq = itertools.count()
+        self._timer = None
+        self._timer_at = None
+        # Метрики
+        self.wait = {name: LatencyStats() for name in LANES}
+        self.depth_max = 0
+        self.retry_after = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+
+    # ---------- очередь ----------
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                # Забываем бакеты чатов, которые давно ничего не отправляли
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+            group = isinstance(chat_id, int) and chat_id < 0
+            bucket = TokenBucket(self.group_rate if group else self.chat_rate, self.chat_burst, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id, lane_name: str):
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (_PRIORITY[lane_name], next(self._seq), chat_id, future))
+        self.depth_max = max(self.depth_max, len(self._heap))
+        self._pump()
+        await future                    # отменённые запросы _pump просто пропускает
+        self.wait[lane_name].record(time.monotonic() - started)
+
+    def _on_timer(self):
+        self._timer = None
+        self._pump()
+
+    def _pump(self):
+        """Раздаёт токены ожидающим в порядке приоритета."""
+        now = time.monotonic()
+        blocked = {}                    # chat_id -> через сколько освободится
+        skipped = []
+        while self._heap and self._global.ready(now):
+            item = heapq.heappop(self._heap)
+            _, _, chat_id, future = item
+            if future.done():
+                continue
+            if chat_id in blocked:
+                skipped.append(item)
+                continue
+            bucket = self._chat_bucket(chat_id, now)
+            if not bucket.ready(now):
+                blocked[chat_id] = bucket.delay(now)
+                skipped.append(item)
+                continue
+            bucket.tokens -= 1
+            self._global.tokens -= 1
+            future.set_result(None)
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        if self._heap:
+            delays = list(blocked.values())
+            if not self._global.ready(now):
+                delays.append(self._global.delay(now))
+            self._schedule(min(delays) if delays else 0.0)
+
+    def _schedule(self, delay: float):
+        at = time.monotonic() + delay
+        if self._timer is not None:
+            if self._timer_at <= at:
+                return
+            self._timer.cancel()
+        self._timer_at = at
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    # ---------- BaseRateLimiter ----------
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        lane_name = None
+        if isinstance(rate_limit_args, dict):
+            lane_name = rate_limit_args.get("lane")
+        lane_name = lane_name or _LANE.get() or (BULK if endpoint.startswith("edit") else NORMAL)
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, lane_name)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after += 1
+                if attempt == self.max_retries:
+                    raise
+                seconds = e.retry_after
+                if isinstance(seconds, timedelta):
+                    seconds = seconds.total_seconds()
+                now = time.monotonic()
+                # Telegram не говорит, какой лимит превышен: тормозим и чат, и всех
+                self._chat_bucket(chat_id, now).pause(now, seconds)
+                self._global.pause(now, seconds)
+                print(f"Telegram RetryAfter {seconds} с ({endpoint}, полоса {lane_name})")
+        return None                     # pragma: no cover
+
+    def metrics(self) -> dict:
+        out = {
+            "send_queue_depth": len(self._heap),
+            "send_queue_depth_max": self.depth_max,
+            "send_retry_after": self.retry_after,
+        }
+        for name, stats in self.wait.items():
+            out.update(stats.metrics(f"send_wait_{name}"))
+        return out
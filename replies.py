@@ -0,0 +1,118 @@
+# replies.py
+"""
+Готовые ответы бота, собранные один раз при запуске.
+
+Reply — неизменяемая пара «текст + клавиатура»: клавиатура хранится уже
+сериализованной в JSON (так её и принимает Bot API), поэтому на каждый
+апдейт не создаются InlineKeyboardButton/InlineKeyboardMarkup и не
+выполняется их to_dict()/json.dumps. python-telegram-bot передаёт
+строковые параметры в запрос как есть.
+
+ReplyRegistry проверяет HTML шаблонов при регистрации (check_html):
+ошибка разметки всплывает при старте бота, а не у пользователя в виде
+"Can't parse entities".
+
+Бенчмарк: python bench/bench_replies.py
+"""
+
+import json
+import re
+from html.parser import HTMLParser
+from typing import NamedTuple, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+
+from rate_limit import lane
+
+# Теги, которые понимает Telegram в parse_mode=HTML
+HTML_TAGS = frozenset((
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "a", "code", "pre", "span", "tg-spoiler", "tg-emoji", "blockquote",
+))
+_BAD_AMP = re.compile(r"&(?!(?:lt|gt|amp|quot|#\d+|#x[0-9a-fA-F]+);)")
+
+
+class _TagChecker(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = []
+        self.errors = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in HTML_TAGS:
+            self.errors.append(f"неподдерживаемый тег <{tag}>")
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack[-1] != tag:
+            self.errors.append(f"лишний или непарный </{tag}>")
+            return
+        self.stack.pop()
+
+
+def check_html(text: str) -> None:
+    """ValueError, если Telegram не примет text с parse_mode=HTML."""
+    checker = _TagChecker()
+    checker.feed(text)
+    checker.close()
+    errors = checker.errors
+    if checker.stack:
+        errors.append("не закрыт <" + ">, <".join(checker.stack) + ">")
+    if _BAD_AMP.search(text):
+        errors.append("голый & (нужно &amp;)")
+    if errors:
+        raise ValueError("; ".join(errors))
+
+
+def keyboard_json(rows) -> str:
+    """Инлайн-клавиатура [[(текст, callback_data), ...], ...] в JSON для Bot API."""
+    markup = InlineKeyboardMarkup(
+        [[InlineKeyboardButton(label, callback_data=data) for label, data in row] for row in rows]
+    )
+    return json.dumps(markup.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+
+class Reply(NamedTuple):
+    """Готовый ответ: параметры send_message/reply_text и полоса исходящей очереди."""
+    text: str
+    parse_mode: Optional[str] = None
+    reply_markup: Optional[str] = None      # JSON клавиатуры
+    lane: Optional[str] = None              # rate_limit.URGENT и т.п.; None — по умолчанию
+
+
+class ReplyRegistry:
+    """Ответы по ключу; наполняется при запуске, дальше только читается."""
+
+    def __init__(self):
+        self._replies = {}
+
+    def add(self, key: str, text: str, html: bool = False, markup: str = None, lane: str = None) -> Reply:
+        if key in self._replies:
+            raise ValueError(f"ответ {key!r} уже зарегистрирован")
+        if html:
+            try:
+                check_html(text)
+            except ValueError as e:
+                raise ValueError(f"ответ {key!r}: {e}") from None
+        reply = Reply(text, ParseMode.HTML if html else None, markup, lane)
+        self._replies[key] = reply
+        return reply
+
+    def __getitem__(self, key: str) -> Reply:
+        return self._replies[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._replies
+
+
+async def send(chat, reply: Reply):
+    """Отправить готовый ответ в чат (telegram.Chat)."""
+    with lane(reply.lane):
+        return await chat.send_message(reply.text, parse_mode=reply.parse_mode, reply_markup=reply.reply_markup)
+
+
+async def answer(message, reply: Reply):
+    """Ответить готовым ответом на сообщение (telegram.Message)."""
+    with lane(reply.lane):
+        return await message.reply_text(reply.text, parse_mode=reply.parse_mode, reply_markup=reply.reply_markup)
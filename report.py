@@ -4,25 +4,46 @@
 
 Читает:
   - stats/events_YYYY-MM-DD.csv
+  - stats/archive/events_YYYY-MM-DD.csv.gz (сжатые закрытые дни; читаются потоково)
   - stats/counters.json (если есть)
+  или, при STATS_BACKEND=sqlite:
+  - stats/events.sqlite3
+
+Агрегаты по CSV кэшируются в stats/.report_cache.json: уже разобранные дни
+повторно не читаются, у текущего дня дочитываются только новые строки.
 
 Печатает:
   1) Общую статистику по сообщениям, кнопкам и кризисным сигналам.
   2) Какие кнопки нажимали чаще всего.
   3) Динамику по дням.
   4) Несколько анонимизированных примеров кризисных сообщений.
+  5) Производительность бота — только с --perf и если есть stats/metrics.json
+     (снимок метрик, который бот сохраняет во время работы).
 
 Запуск:
   python report.py
+  python report.py --jobs 8 --rebuild          # холодная пересборка в 8 процессов
+  python report.py --since 2025-09-01 --until 2025-12-31
+  python report.py --perf                      # добавить раздел о производительности
 """
 
+import argparse
 import csv
+import gzip
+import io
 import json
+import os
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from pathlib import Path
 from textwrap import shorten
 
-STATS_DIR = Path("stats")
+from metrics import quantile
+from stats_store import ARCHIVE_DIR, SqliteBackend, file_day
+
+STATS_DIR = Path(os.getenv("STATS_DIR", "stats"))
+STATS_BACKEND = os.getenv("STATS_BACKEND", "csv").lower()  # csv | sqlite
 
 # Человеческие названия кнопок
 BUTTON_LABELS = {
@@ -34,6 +55,37 @@ BUTTON_LABELS = {
 }
 
 
+def load_metrics():
+    path = STATS_DIR / "metrics.json"
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+
+def print_performance(snapshot: dict):
+    """Раздел 5: p50/p95 по гистограммам из снимка метрик бота."""
+    taken = datetime.fromtimestamp(snapshot.get("ts", 0)).strftime("%Y-%m-%d %H:%M")
+    print(f"⏱ ПРОИЗВОДИТЕЛЬНОСТЬ (снимок метрик от {taken})")
+    print("-" * 60)
+    print("Замер                                |  Кол-во |   p50, мс |   p95, мс")
+    print("-------------------------------------+---------+-----------+----------")
+    for name, h in snapshot.get("histograms", {}).items():
+        for label, series in sorted(h["series"].items()):
+            counts = series["counts"]
+            title = name.removeprefix("bot_") + (f" [{label}]" if label else "")
+            p50 = quantile(h["buckets"], counts, 0.5) * 1000
+            p95 = quantile(h["buckets"], counts, 0.95) * 1000
+            print(f"{title:<36} | {sum(counts):7} | {p50:9.3f} | {p95:9.3f}")
+    gauges = snapshot.get("gauges", {})
+    if "bot_ai_in_flight" in gauges:
+        print(f"\nЗапросов к ИИ в работе: {gauges['bot_ai_in_flight']}, "
+              f"макс. очередь: {gauges.get('bot_ai_queue_depth_max', 0)}")
+    print()
+
+
 def load_counters():
     path = STATS_DIR / "counters.json"
     if not path.exists():
@@ -44,42 +96,275 @@ def load_counters():
         return None
 
 
-def main():
-    if not STATS_DIR.exists():
-        print("⛔ Папка stats/ не найдена. Пока нет данных для отчёта.")
-        return
+# ---------- Инкрементальный кэш агрегатов по CSV ----------
+#
+# Для каждого events_*.csv храним агрегаты и размер/mtime файла. Закрытые дни
+# разбираются один раз; у файла, который дописывается (сегодняшний), читаются
+# только новые байты начиная с сохранённого смещения. Архивы (.csv.gz) не
+# меняются: они читаются потоково целиком, один раз.
+
+CACHE_VERSION = 1
+CRISIS_EXAMPLES = 5
+
+
+def _cache_path() -> Path:
+    return STATS_DIR / ".report_cache.json"
+
+
+def load_cache() -> dict:
+    path = _cache_path()
+    if not path.exists():
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    if data.get("version") != CACHE_VERSION:
+        return {}
+    return data.get("files", {})
+
+
+def save_cache(entries: dict):
+    path = _cache_path()
+    tmp = path.with_suffix(".json.tmp")
+    try:
+        tmp.write_text(json.dumps({"version": CACHE_VERSION, "files": entries}, ensure_ascii=False),
+                       encoding="utf-8")
+        tmp.replace(path)
+    except OSError as e:
+        print(f"(не удалось сохранить кэш отчёта: {e})")
+
+
+def _new_entry() -> dict:
+    return {"size": 0, "mtime": 0, "offset": 0, "fieldnames": None,
+            "types": {}, "buttons": {}, "crisis": []}
+
+
+def _complete_end(data: bytes) -> int:
+    """Смещение конца последней полной CSV-записи (перевод строки вне кавычек)."""
+    end = pos = quotes = 0
+    for line in data.splitlines(keepends=True):
+        pos += len(line)
+        quotes += line.count(b'"')
+        if quotes % 2 == 0 and line.endswith(b"\n"):
+            end = pos
+    return end
+
+
+def _scan_bytes(data: bytes, entry: dict):
+    """Разбирает кусок CSV и добавляет его к агрегатам entry."""
+    # TextIOWrapper с newline=None читает так же, как f.open(encoding="utf-8")
+    _scan_text(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8"), entry)
+
+
+def _scan_text(fh, entry: dict):
+    """Разбирает CSV из текстового потока построчно (память не растёт с размером)."""
+    reader = csv.DictReader(fh, fieldnames=entry["fieldnames"])
+    types, buttons, crisis = entry["types"], entry["buttons"], entry["crisis"]
+    for row in reader:
+        ev_type = row.get("type", "")
+        label = row.get("label", "")
+        text = (row.get("text", "") or "").strip()
+
+        types[ev_type] = types.get(ev_type, 0) + 1
+
+        if ev_type == "button" and label:
+            buttons[label] = buttons.get(label, 0) + 1
+
+        if ev_type == "crisis" and text:
+            if len(crisis) < CRISIS_EXAMPLES:
+                crisis.append(shorten(text, width=120, placeholder="…"))
+    if entry["fieldnames"] is None:
+        entry["fieldnames"] = reader.fieldnames
 
-    files = sorted(STATS_DIR.glob("events_*.csv"))
-    if not files:
-        print("⛔ В папке stats/ нет файлов events_YYYY-MM-DD.csv.")
-        return
 
-    # Совокупные счётчики
+def scan_file(path: Path, entry: dict = None) -> tuple:
+    """
+    Возвращает (запись для кэша, агрегаты файла).
+
+    Если размер и mtime не изменились — файл не читается вовсе. Если файл
+    вырос — читаются только новые байты. Незаконченная последняя запись
+    учитывается в результате, но не попадает в кэш.
+    """
+    st = path.stat()
+    if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+        return entry, entry
+    if path.suffix == ".gz":
+        entry = _new_entry()
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            _scan_text(fh, entry)
+        entry["size"] = entry["offset"] = st.st_size
+        entry["mtime"] = st.st_mtime_ns
+        return entry, entry
+    if not entry or st.st_size < entry["offset"]:
+        entry = _new_entry()
+
+    with path.open("rb") as fh:
+        fh.seek(entry["offset"])
+        data = fh.read()
+    end = _complete_end(data)
+
+    _scan_bytes(data[:end], entry)
+    entry["offset"] += end
+    entry["size"] = st.st_size
+    entry["mtime"] = st.st_mtime_ns
+
+    if end == len(data):
+        return entry, entry
+
+    # Хвост без перевода строки: считаем его сейчас, а в кэше оставляем
+    # смещение перед ним, чтобы в следующий раз дочитать его заново.
+    view = json.loads(json.dumps(entry))
+    _scan_bytes(data[end:], view)
+    entry["size"] = -1
+    return entry, view
+
+
+def cache_name(path: Path) -> str:
+    """Ключ в кэше: имя файла, для архива — archive/имя."""
+    return path.relative_to(STATS_DIR).as_posix()
+
+
+def list_event_files() -> list:
+    """
+    Дневные файлы по возрастанию дня. Если день есть и в CSV, и в архиве
+    (сбой между сжатием и удалением CSV), берётся архив — он полный.
+    """
+    by_day = {file_day(p): p for p in STATS_DIR.glob("events_*.csv")}
+    by_day.update((file_day(p), p) for p in STATS_DIR.glob(f"{ARCHIVE_DIR}/events_*.csv.gz"))
+    return [by_day[day] for day in sorted(by_day)]
+
+
+def _scan_job(args):
+    """Задача для пула процессов: (путь, запись кэша) -> scan_file()."""
+    path, entry = args
+    return scan_file(path, entry)
+
+
+def collect_csv(files, rebuild: bool = False, jobs: int = 1):
+    """
+    Агрегаты по дневным CSV-файлам.
+
+    rebuild — не использовать сохранённый кэш (он будет перезаписан).
+    jobs > 1 — файлы разбираются в пуле процессов. Частичные агрегаты
+    сливаются строго в порядке файлов, поэтому результат (включая первые
+    примеры кризисных сообщений) совпадает с последовательным проходом.
+    """
     total_by_type = Counter()          # message / message_ai / button / crisis / system
     button_counts = Counter()          # по кодам кнопок
     per_day = defaultdict(Counter)     # date -> Counter
     crisis_examples = []               # несколько текстов кризисных сообщений (анонимизированных)
 
-    for f in files:
-        date_str = f.stem.replace("events_", "")  # YYYY-MM-DD
-        with f.open(encoding="utf-8") as fh:
-            reader = csv.DictReader(fh)
-            for row in reader:
-                ev_type = row.get("type", "")
-                label = row.get("label", "")
-                text = (row.get("text", "") or "").strip()
+    cache = {} if rebuild else load_cache()
+    # Записи файлов вне выбранного диапазона дат сохраняем, удалённых файлов — нет
+    existing = {cache_name(p) for p in list_event_files()}
+    new_cache = {name: e for name, e in cache.items() if name in existing}
+
+    job_args = [(f, cache.get(cache_name(f))) for f in files]
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            chunksize = max(1, len(files) // (jobs * 4))
+            results = list(pool.map(_scan_job, job_args, chunksize=chunksize))
+    else:
+        results = [_scan_job(a) for a in job_args]
+
+    for f, (entry, agg) in zip(files, results):
+        date_str = file_day(f)
+        new_cache[cache_name(f)] = entry
+
+        if agg["types"]:
+            total_by_type.update(agg["types"])
+            per_day[date_str].update(agg["types"])
+        button_counts.update(agg["buttons"])
+        for text in agg["crisis"]:
+            if len(crisis_examples) < CRISIS_EXAMPLES:
+                crisis_examples.append(text)
+
+    if new_cache != cache:
+        save_cache(new_cache)
+
+    return total_by_type, button_counts, per_day, crisis_examples
 
-                total_by_type[ev_type] += 1
-                per_day[date_str][ev_type] += 1
 
-                if ev_type == "button" and label:
-                    button_counts[label] += 1
+def collect_sqlite(backend, since: str = None, until: str = None):
+    """Те же агрегаты, но из индексированных таблиц SqliteBackend."""
+    total_by_type = Counter()
+    button_counts = Counter()
+    per_day = defaultdict(Counter)
+    crisis_examples = []
 
-                if ev_type == "crisis" and text:
-                    if len(crisis_examples) < 5:
-                        crisis_examples.append(shorten(text, width=120, placeholder="…"))
+    for day, ev_type, n in backend.day_type_counts(since, until):
+        total_by_type[ev_type] += n
+        per_day[day][ev_type] += n
 
-    counters_json = load_counters()
+    for label, n in backend.button_counts(since, until):
+        button_counts[label] += n
+
+    for text in backend.iter_texts("crisis", since, until):
+        text = (text or "").strip()
+        if text:
+            crisis_examples.append(shorten(text, width=120, placeholder="…"))
+            if len(crisis_examples) >= CRISIS_EXAMPLES:
+                break
+
+    return total_by_type, button_counts, per_day, crisis_examples
+
+
+def _day(value: str) -> str:
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается дата YYYY-MM-DD, получено {value!r}")
+    return value
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Отчёт по работе антибуллинг-бота")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="число процессов для разбора CSV (по умолчанию 1)")
+    parser.add_argument("--since", type=_day, help="первый день отчёта, YYYY-MM-DD")
+    parser.add_argument("--until", type=_day, help="последний день отчёта, YYYY-MM-DD")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="игнорировать кэш и разобрать все файлы заново")
+    parser.add_argument("--perf", action="store_true",
+                        help="добавить раздел о производительности бота (stats/metrics.json)")
+    return parser.parse_args(argv)
+
+
+def in_range(date_str: str, since: str = None, until: str = None) -> bool:
+    return (since is None or date_str >= since) and (until is None or date_str <= until)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if not STATS_DIR.exists():
+        print("⛔ Папка stats/ не найдена. Пока нет данных для отчёта.")
+        return
+
+    if STATS_BACKEND == "sqlite":
+        db_path = STATS_DIR / SqliteBackend.FILENAME
+        if not db_path.exists():
+            print(f"⛔ В папке stats/ нет базы {SqliteBackend.FILENAME}.")
+            return
+        backend = SqliteBackend(STATS_DIR, readonly=True)
+        try:
+            total_by_type, button_counts, per_day, crisis_examples = collect_sqlite(
+                backend, args.since, args.until)
+            counters_json = backend.load_counters()
+            counters_source = f"таблицы daily_counts в {SqliteBackend.FILENAME}"
+        finally:
+            backend.close()
+    else:
+        files = list_event_files()
+        if not files:
+            print("⛔ В папке stats/ нет файлов events_YYYY-MM-DD.csv.")
+            return
+        files = [f for f in files if in_range(file_day(f), args.since, args.until)]
+        total_by_type, button_counts, per_day, crisis_examples = collect_csv(
+            files, rebuild=args.rebuild, jobs=args.jobs)
+        counters_json = load_counters()
+        counters_source = "counters.json"
 
     # ---------- 1. Общая статистика ----------
     days_count = len(per_day)
@@ -98,14 +383,14 @@ def main():
     print()
 
     if counters_json:
-        print("ℹ️ Данные из counters.json (агрегированные):")
+        print(f"ℹ️ Данные из {counters_source} (агрегированные):")
         try:
             b = counters_json.get("buttons", {})
             print(f"  • Сообщений всего: {counters_json.get('messages_total', messages_total)}")
             print(f"  • Сообщений в ИИ-режиме: {counters_json.get('ai_messages', ai_messages)}")
             print(f"  • Кризисных сигналов: {counters_json.get('crisis_detected', crisis_total)}")
         except Exception:
-            print("  (не удалось корректно прочитать counters.json)")
+            print(f"  (не удалось корректно прочитать {counters_source})")
         print()
 
     # ---------- 2. Какие кнопки нажимали чаще ----------
@@ -147,6 +432,12 @@ def main():
     else:
         print("⚠️ За этот период не зафиксировано сообщений с явными кризисными фразами.\n")
 
+    # ---------- 5. Производительность ----------
+    # Технический раздел для разработчиков — в отчёт для школы по умолчанию не попадает
+    snapshot = load_metrics() if args.perf else None
+    if snapshot:
+        print_performance(snapshot)
+
     print("✅ Отчёт сформирован. Этот текст можно копировать в отчёты для школы/вузa,\n"
           "чтобы показать, как бот используется и где нужны дополнительные меры поддержки.")
 
@@ -0,0 +1,384 @@
+# stats_store.py
+"""
+Хранилища анонимной статистики бота.
+
+StatsBackend — минимальный интерфейс, через который StatsLogger пишет события
+и счётчики. Все методы бэкенда синхронные и вызываются ТОЛЬКО из потока
+записи (ThreadedWriter), поэтому могут спокойно делать блокирующий I/O.
+
+CsvBackend    — исходный формат: stats/events_YYYY-MM-DD.csv + counters.json.
+                Закрытые дни сжимаются в stats/archive/events_YYYY-MM-DD.csv.gz,
+                старые удаляются по сроку хранения (compact_csv).
+SqliteBackend — stats/events.sqlite3 (WAL) с агрегатами по дням.
+
+Бэкенд выбирается переменной окружения STATS_BACKEND (csv | sqlite).
+"""
+
+import csv
+import gzip
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+CSV_HEADER = ["ts_utc", "type", "label", "text"]
+ARCHIVE_DIR = "archive"
+
+
+def file_day(path: Path) -> str:
+    """YYYY-MM-DD из имени events_YYYY-MM-DD.csv или events_YYYY-MM-DD.csv.gz."""
+    return Path(path).name[len("events_"):len("events_YYYY-MM-DD")]
+
+
+def archive_path_for(stats_dir: Path, day: str) -> Path:
+    return Path(stats_dir) / ARCHIVE_DIR / f"events_{day}.csv.gz"
+
+
+def compact_csv(stats_dir: Path, today: str, archive_after_days: int = 0, retention_days: int = 0) -> dict:
+    """
+    Обслуживание дневных CSV (вызывается из потока записи при смене дня).
+
+    archive_after_days > 0 — день, закрытый не меньше стольких дней назад,
+    сжимается gzip в archive/ (сначала готовый архив через tmp + replace,
+    потом удаляется CSV; после сбоя между шагами CSV просто удалится
+    в следующий раз). retention_days > 0 — CSV и архивы старше удаляются.
+    counters.json не меняется: это счётчики за всё время.
+    """
+    stats_dir = Path(stats_dir)
+    now = date.fromisoformat(today)
+    result = {"archived": 0, "deleted": 0, "saved_bytes": 0}
+
+    def age(path: Path) -> int:
+        try:
+            return (now - date.fromisoformat(file_day(path))).days
+        except ValueError:
+            return -1               # чужой файл с похожим именем — не трогаем
+
+    if retention_days > 0:
+        for path in stats_dir.glob(f"{ARCHIVE_DIR}/events_*.csv.gz"):
+            if age(path) > retention_days:
+                path.unlink()
+                result["deleted"] += 1
+
+    for path in sorted(stats_dir.glob("events_*.csv")):
+        days = age(path)
+        if days <= 0:
+            continue
+        if retention_days > 0 and days > retention_days:
+            path.unlink()
+            result["deleted"] += 1
+            continue
+        if archive_after_days <= 0 or days < archive_after_days:
+            continue
+        target = archive_path_for(stats_dir, file_day(path))
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix(".gz.tmp")
+            with path.open("rb") as src, gzip.open(tmp, "wb", compresslevel=9) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            os.replace(tmp, target)
+            result["saved_bytes"] += path.stat().st_size - target.stat().st_size
+            result["archived"] += 1
+        path.unlink()
+    return result
+
+
+def default_counters() -> dict:
+    return {
+        "buttons": {
+            "p_self": 0, "p_witness": 0, "p_rights": 0,
+            "p_hotline": 0, "chat_ai": 0
+        },
+        "crisis_detected": 0,
+        "messages_total": 0,
+        "ai_messages": 0
+    }
+
+
+class StatsBackend:
+    """Интерфейс хранилища статистики."""
+
+    def load_counters(self) -> dict:
+        raise NotImplementedError
+
+    def write_rows(self, rows: list) -> None:
+        """Дописывает пачку строк [ts_utc, type, label, text]."""
+        raise NotImplementedError
+
+    def save_counters(self, counters: dict) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class CsvBackend(StatsBackend):
+    """
+    Дневные CSV + counters.json. Файл текущего дня держится открытым
+    и переоткрывается, когда дата в строке меняется (полночь UTC); тогда же
+    (и при первой записи после запуска) закрытые дни сжимаются/удаляются
+    через compact_csv.
+    """
+
+    def __init__(self, stats_dir: Path, archive_after_days: int = 0, retention_days: int = 0):
+        self.stats_dir = Path(stats_dir)
+        self.archive_after_days = archive_after_days
+        self.retention_days = retention_days
+        self.stats_dir.mkdir(parents=True, exist_ok=True)
+        self.counters_path = self.stats_dir / "counters.json"
+        self._day = None            # дата открытого CSV (YYYY-MM-DD)
+        self._fh = None
+        self._csv = None
+
+    def csv_path_for(self, day: str) -> Path:
+        return self.stats_dir / f"events_{day}.csv"
+
+    def _open_day(self, day: str):
+        if self._fh is not None:
+            self._fh.close()
+        p = self.csv_path_for(day)
+        is_new = not p.exists()
+        self._fh = p.open("a", newline="", encoding="utf-8")
+        self._csv = csv.writer(self._fh)
+        if is_new:
+            self._csv.writerow(CSV_HEADER)
+        self._day = day
+        self._compact(day)
+
+    def _compact(self, today: str):
+        if self.archive_after_days <= 0 and self.retention_days <= 0:
+            return
+        try:
+            r = compact_csv(self.stats_dir, today, self.archive_after_days, self.retention_days)
+        except OSError as e:
+            # Не мешаем записи событий: попробуем при следующей смене дня
+            print("Stats compaction error:", repr(e))
+            return
+        if r["archived"] or r["deleted"]:
+            print(f"Статистика: сжато дней {r['archived']} (-{r['saved_bytes'] // 1024} КБ), "
+                  f"удалено файлов {r['deleted']}")
+
+    def load_counters(self) -> dict:
+        if self.counters_path.exists():
+            try:
+                return json.loads(self.counters_path.read_text(encoding="utf-8"))
+            except Exception:
+                pass
+        return default_counters()
+
+    def write_rows(self, rows: list) -> None:
+        for row in rows:
+            day = row[0][:10]
+            if day != self._day:
+                self._open_day(day)
+            self._csv.writerow(row)
+        if self._fh is not None:
+            self._fh.flush()
+
+    def save_counters(self, counters: dict) -> None:
+        tmp = self.counters_path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(counters, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp.replace(self.counters_path)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+        self._fh = self._csv = self._day = None
+
+
+class ThreadedWriter:
+    """
+    Отдельный поток, который выполняет все операции бэкенда по порядку.
+
+    submit() не блокирует: кладёт задачу в queue.Queue и сразу возвращается.
+    Так event loop бота никогда не ждёт диск (fsync, NFS и т.п.).
+    on_done(seconds, имя операции) — необязательный замер каждой операции.
+    """
+
+    _STOP = object()
+
+    def __init__(self, backend: StatsBackend, on_done=None):
+        self.backend = backend
+        self.on_done = on_done
+        self._tasks = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="stats-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._tasks.get()
+            if item is self._STOP:
+                break
+            fn, args = item
+            t0 = time.perf_counter()
+            try:
+                fn(*args)
+            except Exception as e:
+                print("Stats write error:", repr(e))
+            if self.on_done is not None:
+                self.on_done(time.perf_counter() - t0, fn.__name__)
+
+    def submit(self, fn, *args):
+        self._tasks.put((fn, args))
+
+    def pending(self) -> int:
+        return self._tasks.qsize()
+
+    def close(self, timeout: float = None):
+        """Дожидается выполнения всех задач и закрывает бэкенд (блокирующий вызов)."""
+        self._tasks.put(self._STOP)
+        self._thread.join(timeout)
+        self.backend.close()
+
+
+class SqliteBackend(StatsBackend):
+    """
+    SQLite в режиме WAL: stats/events.sqlite3.
+
+    events       — сырые анонимизированные события (для примеров кризисных фраз);
+    daily_counts — агрегаты (день, тип, метка) -> количество.
+
+    Пачка событий и её агрегаты пишутся в ОДНОЙ транзакции, поэтому счётчики
+    никогда не расходятся с событиями, даже при падении процесса. Счётчики
+    бота выводятся из daily_counts, отдельного counters.json нет.
+    """
+
+    FILENAME = "events.sqlite3"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            id     INTEGER PRIMARY KEY,
+            ts_utc TEXT NOT NULL,
+            type   TEXT NOT NULL,
+            label  TEXT NOT NULL,
+            text   TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_type ON events(type);
+        CREATE TABLE IF NOT EXISTS daily_counts (
+            day      TEXT NOT NULL,
+            type     TEXT NOT NULL,
+            label    TEXT NOT NULL,
+            n        INTEGER NOT NULL,
+            first_id INTEGER NOT NULL,
+            PRIMARY KEY (day, type, label)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS daily_counts_type_label ON daily_counts(type, label);
+    """
+
+    def __init__(self, stats_dir: Path, readonly: bool = False):
+        """
+        readonly=True — для report.py: база открывается только на чтение
+        (mode=ro), без создания папки, схемы и смены режима журнала,
+        поэтому отчёт не мешает работающему боту и ничего не меняет в файле.
+        """
+        self.stats_dir = Path(stats_dir)
+        self.path = self.stats_dir / self.FILENAME
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{self.path.resolve()}?mode=ro", uri=True)
+            return
+        self.stats_dir.mkdir(parents=True, exist_ok=True)
+        # Соединение создаётся в основном потоке, а пишет поток ThreadedWriter;
+        # одновременного доступа нет, поэтому check_same_thread не нужен.
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def load_counters(self) -> dict:
+        counters = default_counters()
+        for ev_type, label, n in self.conn.execute(
+            "SELECT type, label, SUM(n) FROM daily_counts GROUP BY type, label"
+        ):
+            if ev_type == "button" and label in counters["buttons"]:
+                counters["buttons"][label] += n
+            if ev_type == "crisis":
+                counters["crisis_detected"] += n
+            if ev_type == "message":
+                counters["messages_total"] += n
+            if ev_type == "message_ai":
+                counters["messages_total"] += n
+                counters["ai_messages"] += n
+        return counters
+
+    def write_rows(self, rows: list) -> None:
+        if not rows:
+            return
+        with self.conn:
+            (next_id,) = self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM events").fetchone()
+            events = []
+            agg = {}
+            for i, (ts, ev_type, label, text) in enumerate(rows, start=next_id):
+                events.append((i, ts, ev_type, label, text))
+                key = (ts[:10], ev_type, label)
+                if key in agg:
+                    agg[key][0] += 1
+                else:
+                    agg[key] = [1, i]
+            self.conn.executemany(
+                "INSERT INTO events (id, ts_utc, type, label, text) VALUES (?, ?, ?, ?, ?)", events
+            )
+            self.conn.executemany(
+                "INSERT INTO daily_counts (day, type, label, n, first_id) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, type, label) DO UPDATE SET n = n + excluded.n",
+                [(*key, n, first_id) for key, (n, first_id) in agg.items()]
+            )
+
+    def save_counters(self, counters: dict) -> None:
+        # Счётчики выводятся из daily_counts и уже сохранены в write_rows.
+        pass
+
+    def close(self) -> None:
+        self.conn.close()
+
+    # ---------- чтение для report.py ----------
+
+    # since/until — включительные границы по дням (YYYY-MM-DD), None = без границы.
+
+    def day_type_counts(self, since: str = None, until: str = None):
+        """(день, тип, количество) по возрастанию дня."""
+        return self.conn.execute(
+            "SELECT day, type, SUM(n) FROM daily_counts WHERE day BETWEEN ? AND ? "
+            "GROUP BY day, type ORDER BY day",
+            (since or "0000-00-00", until or "9999-99-99")
+        ).fetchall()
+
+    def button_counts(self, since: str = None, until: str = None):
+        """(метка, количество) в порядке первого нажатия."""
+        return self.conn.execute(
+            "SELECT label, SUM(n) FROM daily_counts WHERE type = 'button' AND label != '' "
+            "AND day BETWEEN ? AND ? GROUP BY label ORDER BY MIN(first_id)",
+            (since or "0000-00-00", until or "9999-99-99")
+        ).fetchall()
+
+    def iter_texts(self, ev_type: str, since: str = None, until: str = None):
+        """Тексты событий заданного типа в порядке записи."""
+        cur = self.conn.execute(
+            "SELECT text FROM events WHERE type = ? AND substr(ts_utc, 1, 10) BETWEEN ? AND ? "
+            "ORDER BY id",
+            (ev_type, since or "0000-00-00", until or "9999-99-99")
+        )
+        for (text,) in cur:
+            yield text
+
+
+BACKENDS = {
+    "csv": CsvBackend,
+    "sqlite": SqliteBackend,
+}
+
+
+def open_backend(kind: str, stats_dir: Path, archive_after_days: int = 0,
+                 retention_days: int = 0) -> StatsBackend:
+    """archive_after_days/retention_days — только для csv (см. compact_csv)."""
+    try:
+        cls = BACKENDS[kind.lower()]
+    except KeyError:
+        raise RuntimeError(f"Неизвестный STATS_BACKEND: {kind!r} (доступно: {', '.join(BACKENDS)})")
+    if cls is CsvBackend:
+        return cls(stats_dir, archive_after_days, retention_days)
+    return cls(stats_dir)
@@ -0,0 +1,99 @@
+# update_processor.py
+"""
+Параллельная обработка апдейтов с сохранением порядка внутри чата.
+
+По умолчанию python-telegram-bot обрабатывает апдейты строго по одному:
+долгий ответ ИИ одному пользователю задерживает /start и кнопки у всех
+остальных. PerChatUpdateProcessor обрабатывает апдейты разных чатов
+параллельно (не больше max_concurrent_handlers одновременно), а апдейты
+одного чата — строго по очереди, в порядке поступления. Поэтому
+включение режима ИИ, /stopchat и следующее сообщение того же
+пользователя не обгоняют друг друга.
+
+Порядок: Application создаёт задачу на каждый апдейт в порядке очереди,
+и первое, что делает задача, — встаёт в очередь на замок своего чата
+(asyncio.Lock отдаёт замок в порядке FIFO). Только получив замок чата,
+апдейт занимает общий слот. Так апдейты, ждущие свой чат, не занимают
+слоты, нужные другим пользователям.
+
+max_pending (семафор BaseUpdateProcessor) ограничивает число апдейтов
+в работе вместе с ожидающими — это защита памяти от лавины апдейтов.
+"""
+
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def chat_key(update: object):
+    """Ключ упорядочивания: чат, иначе пользователь, иначе None (без порядка)."""
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return ("user", update.effective_user.id)
+    return None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты разных чатов — параллельно, одного чата — по очереди."""
+
+    __slots__ = ("_handlers", "_locks", "_waiting", "active", "active_max", "chat_waits")
+
+    def __init__(self, max_concurrent_handlers: int, max_pending: int = 1000):
+        super().__init__(max(max_pending, max_concurrent_handlers))
+        self._handlers = asyncio.BoundedSemaphore(max_concurrent_handlers)
+        self._locks = {}                # ключ чата -> asyncio.Lock
+        self._waiting = {}              # ключ чата -> число апдейтов в работе/ожидании
+        # Метрики
+        self.active = 0
+        self.active_max = 0
+        self.chat_waits = 0             # апдейтов, которым пришлось ждать свой чат
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update, coroutine) -> None:
+        key = chat_key(update)
+        if key is None:
+            async with self._handlers:
+                await self._run(coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        if lock.locked():
+            self.chat_waits += 1
+        try:
+            async with lock, self._handlers:
+                await self._run(coroutine)
+        finally:
+            left = self._waiting[key] - 1
+            if left:
+                self._waiting[key] = left
+            else:
+                # Замки неактивных чатов не копим
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def _run(self, coroutine):
+        self.active += 1
+        self.active_max = max(self.active_max, self.active)
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
+
+    def metrics(self) -> dict:
+        return {
+            "updates_active": self.active,
+            "updates_active_max": self.active_max,
+            "updates_chat_waits": self.chat_waits,
+            "updates_chats_pending": len(self._locks),
+        }
@@ -0,0 +1,157 @@
+# webhook.py
+"""
+Режим webhook: встроенный HTTP-сервер на asyncio вместо run_polling.
+
+Без новых зависимостей (run_webhook из python-telegram-bot требует
+tornado). Сервер понимает ровно то, что нужно боту:
+
+  POST /<WEBHOOK_PATH>  — апдейт от Telegram (JSON). Проверяется заголовок
+                          X-Telegram-Bot-Api-Secret-Token, апдейт кладётся
+                          в app.update_queue, ответ 200 отдаётся сразу.
+  GET  /healthz         — процесс жив и event loop отвечает (200).
+  GET  /readyz          — готов принимать апдейты (200) или нет (503):
+                          до старта Application и во время остановки.
+  GET  /metrics         — метрики Prometheus, если передан MetricsRegistry.
+
+Остановка (SIGTERM/SIGINT) — «мягкая»:
+  1) /readyz начинает отдавать 503, новые апдейты получают 503
+     (Telegram повторит их позже или отдаст другой реплике); ещё
+     ready_grace секунд порт открыт, чтобы балансировщик это увидел;
+  2) сервер перестаёт принимать соединения, дожидается начатых запросов;
+  3) ждём, пока обработчики разберут уже принятые апдейты (не дольше
+     drain_timeout), затем app.stop() — он же дожидается create_task;
+  4) app.shutdown() и post_shutdown (stats.close — сброс буфера статистики).
+
+Локальная проверка — отправить записанные апдейты:
+  python bench/post_updates.py updates.jsonl --url http://127.0.0.1:8080/telegram
+"""
+
+import asyncio
+import json
+import signal
+import time
+
+from telegram import Update
+
+from http_server import MAX_BODY, HttpServer
+
+
+class WebhookServer(HttpServer):
+    """
+    HTTP-приёмник апдейтов для одного Application.
+
+    path=None — без приёма апдейтов: только /healthz, /readyz и /metrics
+    (так main.py отдаёт метрики в режиме polling).
+    """
+
+    def __init__(self, app, path: str = "telegram", secret: str = None, max_body: int = MAX_BODY,
+                 metrics=None):
+        super().__init__(max_body)
+        self.app = app
+        self.metrics_registry = metrics
+        self.path = "/" + path.strip("/") if path else None
+        if metrics is not None and self.path:
+            metrics.collect(self.metrics, name="webhook")
+        self.secret = secret or None
+        # Метрики
+        self.accepted = 0
+        self.rejected = 0
+        self.bad = 0
+
+    def ready(self) -> bool:
+        return not self.draining and self.app.running
+
+    def metrics(self) -> dict:
+        return {
+            "webhook_accepted": self.accepted,
+            "webhook_rejected": self.rejected,
+            "webhook_bad": self.bad,
+            "webhook_connections": len(self._conns),
+        }
+
+    async def route(self, method: str, target: str, headers: dict, body: bytes):
+        if body is None:
+            return 413, "payload too large"
+        if target == "/healthz":
+            return 200, "ok"
+        if target == "/readyz":
+            return (200, "ready") if self.ready() else (503, "not ready")
+        if target == "/metrics" and self.metrics_registry is not None:
+            return 200, self.metrics_registry.render()
+        if self.path is None or target != self.path:
+            return 404, "not found"
+        if method != "POST":
+            return 405, "method not allowed"
+        if self.secret and headers.get("x-telegram-bot-api-secret-token") != self.secret:
+            self.bad += 1
+            return 403, "forbidden"
+        if not self.ready():
+            self.rejected += 1
+            return 503, "draining"
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except (ValueError, TypeError, KeyError):
+            self.bad += 1
+            return 400, "bad update"
+        if update is None:
+            self.bad += 1
+            return 400, "bad update"
+        await self.app.update_queue.put(update)
+        self.accepted += 1
+        return 200, "ok"
+
+
+async def serve(app, host: str, port: int, path: str, secret: str = None,
+                public_url: str = None, drain_timeout: float = 25.0, metrics=None,
+                ready_grace: float = 0.0) -> WebhookServer:
+    """
+    Полный жизненный цикл Application в режиме webhook (аналог run_polling).
+    Возвращает сервер после остановки — для метрик.
+
+    public_url без secret — ошибка: зарегистрированный вебхук принимал бы
+    апдейты от кого угодно, кто знает адрес.
+    """
+    if public_url and not secret:
+        raise RuntimeError("WEBHOOK_URL задан без WEBHOOK_SECRET: публичный вебхук без проверки")
+    server = WebhookServer(app, path, secret, metrics=metrics)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    try:
+        await app.start()
+        await server.start(host, port)
+        if public_url:
+            # Вебхук не удаляем при остановке: его могут обслуживать другие реплики
+            await app.bot.set_webhook(
+                url=public_url.rstrip("/") + server.path,
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        print(f"Webhook: слушаю {host}:{port}{server.path}")
+        await stop.wait()
+
+        print("Webhook: остановка, дожидаюсь обработки принятых апдейтов...")
+        started = time.monotonic()
+        await server.close(grace=ready_grace)
+        try:
+            await asyncio.wait_for(app.update_queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Webhook: не дождались {app.update_queue.qsize()} апдейтов за {drain_timeout:.0f} с")
+        await app.stop()
+        print(f"Webhook: апдейты обработаны за {time.monotonic() - started:.1f} с")
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        if not server.draining:
+            await server.close()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+    return server